@@ -3,8 +3,11 @@ Flask Application Factory
 Initializes and configures the Flask application with all extensions and blueprints
 """
 import os
+import sqlite3
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from flask_migrate import Migrate
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -15,6 +18,20 @@ db = SQLAlchemy()
 migrate = Migrate()
 limiter = Limiter(key_func=get_remote_address)
 
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """Use WAL on SQLite so readers do not wait on the (single) writer across workers"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')  # Durable in WAL mode; skips an fsync per commit
+    cursor.execute('PRAGMA busy_timeout=5000')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.execute('PRAGMA cache_size=-65536')
+    cursor.close()
+
 def create_app(config_name=None):
     """Application factory pattern for creating Flask app instances"""
     if config_name is None:
@@ -29,6 +46,10 @@ def create_app(config_name=None):
     # Ensure upload folder exists and initialize organized structure
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
+    # Keep the uploads folder open so saves skip full path resolution (POSIX only)
+    if os.open in os.supports_dir_fd and hasattr(os, 'O_DIRECTORY'):
+        app.config['UPLOADS_FD'] = os.open(app.config['UPLOAD_FOLDER'], os.O_RDONLY | os.O_DIRECTORY)
+    
     # Initialize organized file structure
     with app.app_context():
         from app.utils.file_organization import ensure_uploads_structure
@@ -36,7 +57,7 @@ def create_app(config_name=None):
     
     # Initialize extensions with app
     db.init_app(app)
-    migrate.init_app(app, db)
+    migrate.init_app(app, db, render_as_batch=True)  # SQLite needs batch mode to alter columns
     limiter.init_app(app)
     
     # Register blueprints
@@ -56,9 +77,10 @@ def create_app(config_name=None):
     app.register_blueprint(website_bp, url_prefix='/website')
     app.register_blueprint(site_bp, url_prefix='/site')
     
-    # Create database tables
-    with app.app_context():
-        db.create_all()
+    # Create database tables (skipped in production to avoid reflecting every table per boot)
+    if app.config.get('AUTO_CREATE_TABLES'):
+        with app.app_context():
+            db.create_all()
     
     # Error handlers
     @app.errorhandler(404)
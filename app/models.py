@@ -3,12 +3,129 @@ Database Models
 Defines the data structures for files, links, and analytics tracking
 """
 import os
-import string
+import re
+import time
+import hashlib
 import secrets
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+from werkzeug.security import check_password_hash
 from app import db
 
+# MIME type -> extension fallback for files uploaded without one
+_MIME_TO_EXT = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/jpg': 'jpg',
+    'image/gif': 'gif',
+    'image/bmp': 'bmp',
+    'image/svg+xml': 'svg',
+    'image/webp': 'webp',
+    'text/html': 'html',
+    'text/css': 'css',
+    'text/javascript': 'js',
+    'application/javascript': 'js',
+    'application/json': 'json',
+    'application/xml': 'xml',
+    'text/xml': 'xml',
+    'text/plain': 'txt',
+    'application/pdf': 'pdf',
+    'audio/mpeg': 'mp3',
+    'audio/wav': 'wav',
+    'audio/ogg': 'ogg',
+    'audio/mp4': 'm4a',
+    'video/mp4': 'mp4',
+    'video/webm': 'webm',
+    'video/ogg': 'ogg',
+    'video/avi': 'avi',
+    'video/quicktime': 'mov',
+}
+
+# Extension -> preview type ('ogg' previews as audio)
+_PREVIEW_TYPE = {
+    # Web files
+    'html': 'html', 'htm': 'html',
+    # Text files
+    'css': 'text', 'js': 'text', 'json': 'text', 'xml': 'text', 'txt': 'text', 'md': 'text',
+    'py': 'text', 'java': 'text', 'cpp': 'text', 'c': 'text', 'h': 'text', 'cs': 'text',
+    'php': 'text', 'rb': 'text', 'go': 'text', 'rs': 'text',
+    # Images
+    'jpg': 'image', 'jpeg': 'image', 'png': 'image', 'gif': 'image', 'bmp': 'image',
+    'svg': 'image', 'webp': 'image',
+    # Documents
+    'pdf': 'pdf',
+    # Audio
+    'mp3': 'audio', 'wav': 'audio', 'ogg': 'audio', 'm4a': 'audio',
+    # Video
+    'mp4': 'video', 'webm': 'video', 'avi': 'video', 'mov': 'video',
+}
+
+def _default_preview_type(context):
+    """Column default deriving the preview type from the extension being inserted"""
+    ext = context.get_current_parameters().get('file_extension')
+    if ext is None:
+        return None
+    return _PREVIEW_TYPE.get(ext, 'unsupported')
+
+# Website slug normalization
+_SLUG_STRIP = re.compile(r'[^\w\s-]')
+_SLUG_DASH = re.compile(r'[-\s]+')
+
+# Argon2id password hashing (native implementation)
+_password_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
+
+def _hash_password(password):
+    """Hash a password with Argon2id"""
+    return _password_hasher.hash(password)
+
+def _verify_password(password_hash, password):
+    """Verify a password against an Argon2 hash or a legacy werkzeug hash"""
+    if not password_hash.startswith('$argon2'):
+        # Hashes created before the switch to Argon2
+        return check_password_hash(password_hash, password)
+    
+    try:
+        return _password_hasher.verify(password_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+def _password_needs_rehash(password_hash):
+    """Check whether a hash is legacy werkzeug or uses outdated Argon2 parameters"""
+    if not password_hash.startswith('$argon2'):
+        return True
+    return _password_hasher.check_needs_rehash(password_hash)
+
+# Recently verified share/site passwords, keyed on (hash, sha256(password)).
+# Only successes are cached, so failed guesses always pay the full KDF cost.
+_VERIFY_CACHE_SIZE = 4096
+_VERIFY_CACHE_TTL = 300  # seconds
+_verify_cache = OrderedDict()
+_verify_cache_lock = threading.Lock()
+
+def _verify_password_cached(password_hash, password):
+    """Verify a password, skipping the KDF for recently verified pairs"""
+    key = (password_hash, hashlib.sha256(password.encode()).digest())
+    now = time.monotonic()
+    
+    with _verify_cache_lock:
+        expires = _verify_cache.get(key)
+        if expires is not None and expires > now:
+            _verify_cache.move_to_end(key)
+            return True
+    
+    if not _verify_password(password_hash, password):
+        return False
+    
+    with _verify_cache_lock:
+        _verify_cache[key] = now + _VERIFY_CACHE_TTL
+        _verify_cache.move_to_end(key)
+        while len(_verify_cache) > _VERIFY_CACHE_SIZE:
+            _verify_cache.popitem(last=False)
+    return True
+
 class File(db.Model):
     """Model for uploaded files"""
     __tablename__ = 'files'
@@ -18,90 +135,51 @@ class File(db.Model):
     stored_filename = db.Column(db.String(255), unique=True, nullable=False)
     file_size = db.Column(db.Integer, nullable=False)
     mime_type = db.Column(db.String(100))
-    upload_date = db.Column(db.DateTime, default=datetime.utcnow)
+    upload_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     upload_ip = db.Column(db.String(45))
+    file_extension = db.Column(db.String(255))  # Set once at upload time
+    preview_type = db.Column(db.String(20), default=_default_preview_type)  # Derived from file_extension on insert
+    stored_location = db.Column(db.String(255))  # Folder under UPLOAD_FOLDER ('' for flat); NULL for legacy rows
     
     # Relationship with links
-    links = db.relationship('Link', backref='file', lazy='dynamic', cascade='all, delete-orphan')
+    links = db.relationship('Link', back_populates='file', cascade='all, delete-orphan')
+    
+    # Owners of this file (shared uploads and website assets)
+    user_files = db.relationship('UserFile', back_populates='file')
+    website_files = db.relationship('WebsiteFile', back_populates='file')
     
     def __repr__(self):
         return f'<File {self.original_filename}>'
     
-    def get_file_extension(self):
+    @staticmethod
+    def extension_for(filename, mime_type=None):
         """Extract file extension from filename, with MIME type fallback"""
-        # First try to get extension from filename
-        if '.' in self.original_filename:
-            return self.original_filename.rsplit('.', 1)[1].lower()
+        # First try to get extension from filename (slice, no intermediate list)
+        dot = filename.rfind('.')
+        if dot != -1:
+            return filename[dot + 1:].lower()
         
         # Fallback to MIME type detection
-        if self.mime_type:
-            mime_to_ext = {
-                'image/png': 'png',
-                'image/jpeg': 'jpg',
-                'image/jpg': 'jpg',
-                'image/gif': 'gif',
-                'image/bmp': 'bmp',
-                'image/svg+xml': 'svg',
-                'image/webp': 'webp',
-                'text/html': 'html',
-                'text/css': 'css',
-                'text/javascript': 'js',
-                'application/javascript': 'js',
-                'application/json': 'json',
-                'application/xml': 'xml',
-                'text/xml': 'xml',
-                'text/plain': 'txt',
-                'application/pdf': 'pdf',
-                'audio/mpeg': 'mp3',
-                'audio/wav': 'wav',
-                'audio/ogg': 'ogg',
-                'audio/mp4': 'm4a',
-                'video/mp4': 'mp4',
-                'video/webm': 'webm',
-                'video/ogg': 'ogg',
-                'video/avi': 'avi',
-                'video/quicktime': 'mov',
-            }
-            return mime_to_ext.get(self.mime_type.lower(), '')
+        if mime_type:
+            return _MIME_TO_EXT.get(mime_type.lower(), '')
         
         return ''
     
+    def get_file_extension(self):
+        """Get the file extension, computing it for rows uploaded before it was stored"""
+        if self.file_extension is not None:
+            return self.file_extension
+        return File.extension_for(self.original_filename, self.mime_type)
+    
     def is_previewable(self):
         """Check if file can be previewed"""
-        ext = self.get_file_extension()
-        return ext in [
-            # Web files
-            'html', 'htm', 'css', 'js', 'json', 'xml',
-            # Text files
-            'txt', 'md', 'py', 'java', 'cpp', 'c', 'h', 'cs', 'php', 'rb', 'go', 'rs',
-            # Images
-            'jpg', 'jpeg', 'png', 'gif', 'bmp', 'svg', 'webp',
-            # Documents
-            'pdf',
-            # Audio
-            'mp3', 'wav', 'ogg', 'm4a',
-            # Video
-            'mp4', 'webm', 'ogg', 'avi', 'mov'
-        ]
+        return self.get_preview_type() != 'unsupported'
     
     def get_preview_type(self):
-        """Get the type of preview for this file"""
-        ext = self.get_file_extension()
-        
-        if ext in ['html', 'htm']:
-            return 'html'
-        elif ext in ['css', 'js', 'json', 'xml', 'txt', 'md', 'py', 'java', 'cpp', 'c', 'h', 'cs', 'php', 'rb', 'go', 'rs']:
-            return 'text'
-        elif ext in ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'svg', 'webp']:
-            return 'image'
-        elif ext == 'pdf':
-            return 'pdf'
-        elif ext in ['mp3', 'wav', 'ogg', 'm4a']:
-            return 'audio'
-        elif ext in ['mp4', 'webm', 'ogg', 'avi', 'mov']:
-            return 'video'
-        else:
-            return 'unsupported'
+        """Get the type of preview for this file, computing it for rows stored before it was"""
+        if self.preview_type is not None:
+            return self.preview_type
+        return _PREVIEW_TYPE.get(self.get_file_extension(), 'unsupported')
 
 class Link(db.Model):
     """Model for shareable links"""
@@ -114,44 +192,45 @@ class Link(db.Model):
     expiry_date = db.Column(db.DateTime, nullable=True)
     
     # Security
-    password_hash = db.Column(db.String(128), nullable=True)
+    password_hash = db.Column(db.String(255), nullable=True)
     is_active = db.Column(db.Boolean, default=True)
     
     # Analytics
     view_count = db.Column(db.Integer, default=0)
     last_accessed = db.Column(db.DateTime, nullable=True)
     
-    # Relationship with analytics
-    analytics = db.relationship('Analytics', backref='link', lazy='dynamic', cascade='all, delete-orphan')
+    # Relationships with file and analytics
+    file = db.relationship('File', back_populates='links')
+    analytics = db.relationship('Analytics', back_populates='link', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Link {self.slug}>'
     
     @staticmethod
     def generate_slug(length=8):
-        """Generate a unique URL-safe slug"""
-        alphabet = string.ascii_letters + string.digits
-        while True:
-            slug = ''.join(secrets.choice(alphabet) for _ in range(length))
-            if not Link.query.filter_by(slug=slug).first():
-                return slug
+        """Generate a random URL-safe slug (uniqueness is enforced by the DB on insert)"""
+        return secrets.token_urlsafe(length)[:length]
+    
+    @staticmethod
+    def generate_slugs(count, length=8):
+        """Generate distinct unused slugs, checking each batch against the DB in one query"""
+        slugs = set()
+        while len(slugs) < count:
+            candidates = {Link.generate_slug(length) for _ in range(count - len(slugs))} - slugs
+            taken = set(db.session.scalars(db.select(Link.slug).where(Link.slug.in_(candidates))))
+            slugs |= candidates - taken
+        return list(slugs)
     
     def set_password(self, password):
         """Set password protection for the link"""
         if password:
-            self.password_hash = generate_password_hash(password)
+            self.password_hash = _hash_password(password)
     
     def check_password(self, password):
         """Verify password for protected link"""
         if not self.password_hash:
             return True
-        return check_password_hash(self.password_hash, password)
-    
-    def increment_views(self):
-        """Increment view counter and update last accessed time"""
-        self.view_count += 1
-        self.last_accessed = datetime.utcnow()
-        db.session.commit()
+        return _verify_password_cached(self.password_hash, password)
     
     def is_expired(self):
         """Check if link has expired"""
@@ -166,15 +245,22 @@ class Link(db.Model):
 class Analytics(db.Model):
     """Model for tracking link analytics"""
     __tablename__ = 'analytics'
+    __table_args__ = (
+        # Per-link history ordered by date (analytics endpoint)
+        db.Index('ix_analytics_link_date', 'link_id', 'access_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     link_id = db.Column(db.Integer, db.ForeignKey('links.id'), nullable=False)
-    access_date = db.Column(db.DateTime, default=datetime.utcnow)
+    access_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     ip_address = db.Column(db.String(45))
     user_agent = db.Column(db.String(255))
     referrer = db.Column(db.String(255))
     country = db.Column(db.String(2))  # ISO country code
     
+    # Relationship with link
+    link = db.relationship('Link', back_populates='analytics')
+    
     def __repr__(self):
         return f'<Analytics {self.id} for Link {self.link_id}>'
 
@@ -184,7 +270,7 @@ class User(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(255))
     full_name = db.Column(db.String(100), nullable=False)
     created_date = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime)
@@ -194,13 +280,15 @@ class User(db.Model):
     # Storage limits
     storage_used = db.Column(db.BigInteger, default=0)  # in bytes
     max_storage = db.Column(db.BigInteger, default=1073741824)  # 1GB default
+    # Set when storage_used may have drifted; existing rows start dirty so they are recomputed once
+    storage_dirty = db.Column(db.Boolean, default=False, server_default=db.true(), nullable=False)
     
     # Premium status
     is_premium = db.Column(db.Boolean, default=False)
     
     # User files and websites relationship
-    user_files = db.relationship('UserFile', backref='user', lazy='dynamic', cascade='all, delete-orphan')
-    websites = db.relationship('Website', backref='owner', lazy='dynamic', cascade='all, delete-orphan')
+    user_files = db.relationship('UserFile', back_populates='user', cascade='all, delete-orphan')
+    websites = db.relationship('Website', back_populates='owner', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<User {self.email}>'
@@ -214,11 +302,15 @@ class User(db.Model):
     
     def set_password(self, password):
         """Set user password"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = _hash_password(password)
     
     def check_password(self, password):
         """Verify user password"""
-        return check_password_hash(self.password_hash, password)
+        return _verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """Check whether the stored hash should be upgraded to current Argon2 settings"""
+        return _password_needs_rehash(self.password_hash)
     
     def can_upload(self, file_size):
         """Check if user has enough storage space"""
@@ -229,21 +321,48 @@ class User(db.Model):
         self.storage_used = max(0, self.storage_used + size_delta)
         db.session.commit()
     
+    def reserve_storage(self, size, limit=None):
+        """Atomically add size to storage usage unless that would exceed limit; returns False if refused"""
+        # Check and increment in one UPDATE so concurrent uploads cannot both pass the limit
+        stmt = db.update(User).where(User.id == self.id)
+        if limit is not None:
+            stmt = stmt.where(User.storage_used + size <= limit)
+        result = db.session.execute(
+            stmt.values(storage_used=User.storage_used + size),
+            execution_options={'synchronize_session': False}
+        )
+        if not result.rowcount:
+            return False
+        
+        # Reload the stored value on next access rather than guessing it
+        db.session.expire(self, ['storage_used'])
+        return True
+    
     def recalculate_storage(self):
         """Recalculate storage usage from actual files"""
-        total = 0
         # Sum up all user's uploaded files
-        for user_file in self.user_files:
-            if user_file.file:
-                total += user_file.file.file_size
+        user_total = db.session.query(
+            db.func.coalesce(db.func.sum(File.file_size), 0)
+        ).join(
+            UserFile, UserFile.file_id == File.id
+        ).filter(
+            UserFile.user_id == self.id
+        ).scalar()
         
         # Sum up all website files
-        for website in self.websites:
-            for website_file in website.website_files:
-                if website_file.file:
-                    total += website_file.file.file_size
+        site_total = db.session.query(
+            db.func.coalesce(db.func.sum(File.file_size), 0)
+        ).join(
+            WebsiteFile, WebsiteFile.file_id == File.id
+        ).join(
+            Website, Website.id == WebsiteFile.website_id
+        ).filter(
+            Website.user_id == self.id
+        ).scalar()
         
+        total = user_total + site_total
         self.storage_used = total
+        self.storage_dirty = False
         db.session.commit()
         return total
 
@@ -256,8 +375,9 @@ class UserFile(db.Model):
     file_id = db.Column(db.Integer, db.ForeignKey('files.id'), nullable=False)
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # Relationship with file
-    file = db.relationship('File', backref='user_files')
+    # Relationships with user and file
+    user = db.relationship('User', back_populates='user_files')
+    file = db.relationship('File', back_populates='user_files')
     
     def __repr__(self):
         return f'<UserFile User:{self.user_id} File:{self.file_id}>'
@@ -275,13 +395,14 @@ class Website(db.Model):
     updated_date = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_published = db.Column(db.Boolean, default=False)
     is_public = db.Column(db.Boolean, default=True)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(255))
     
     # Statistics
     view_count = db.Column(db.Integer, default=0)
     
-    # Website files relationship
-    website_files = db.relationship('WebsiteFile', backref='website', lazy='dynamic', cascade='all, delete-orphan')
+    # Owner and website files relationships
+    owner = db.relationship('User', back_populates='websites')
+    website_files = db.relationship('WebsiteFile', back_populates='website', cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Website {self.name}>'
@@ -289,14 +410,16 @@ class Website(db.Model):
     @staticmethod
     def generate_slug(name):
         """Generate URL-safe slug from website name"""
-        import re
-        slug = re.sub(r'[^\w\s-]', '', name.lower())
-        slug = re.sub(r'[-\s]+', '-', slug)
+        slug = _SLUG_STRIP.sub('', name.lower())
+        slug = _SLUG_DASH.sub('-', slug)
         
-        # Ensure uniqueness
+        # Ensure uniqueness against every taken slug sharing the prefix (one query)
         base_slug = slug[:45]
+        existing = set(db.session.scalars(
+            db.select(Website.slug).where(Website.slug.startswith(base_slug, autoescape=True))
+        ))
         counter = 1
-        while Website.query.filter_by(slug=slug).first():
+        while slug in existing:
             slug = f"{base_slug}-{counter}"
             counter += 1
         
@@ -305,13 +428,13 @@ class Website(db.Model):
     def set_password(self, password):
         """Set password protection for the website"""
         if password:
-            self.password_hash = generate_password_hash(password)
+            self.password_hash = _hash_password(password)
     
     def check_password(self, password):
         """Verify password for protected website"""
         if not self.password_hash:
             return True
-        return check_password_hash(self.password_hash, password)
+        return _verify_password_cached(self.password_hash, password)
     
     def get_url(self, base_url):
         """Generate full URL for the website"""
@@ -320,6 +443,11 @@ class Website(db.Model):
 class WebsiteFile(db.Model):
     """Files associated with a website"""
     __tablename__ = 'website_files'
+    __table_args__ = (
+        # Index lookup and asset-by-path lookup within one site
+        db.Index('ix_website_files_site_index', 'website_id', 'is_index'),
+        db.Index('ix_website_files_site_path', 'website_id', 'file_path'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     website_id = db.Column(db.Integer, db.ForeignKey('websites.id'), nullable=False)
@@ -327,8 +455,12 @@ class WebsiteFile(db.Model):
     file_path = db.Column(db.String(255), nullable=False)  # Path within website structure
     is_index = db.Column(db.Boolean, default=False)  # Is this the index.html file?
     
-    # Relationship with file
-    file = db.relationship('File', backref='website_files')
+    # Relationships with website and file
+    website = db.relationship('Website', back_populates='website_files')
+    file = db.relationship('File', back_populates='website_files')
     
     def __repr__(self):
         return f'<WebsiteFile Website:{self.website_id} File:{self.file_id}>'
+
+# One entry per path within a site (case-insensitive); uploads replace rather than duplicate
+db.Index('ux_website_files_site_path_ci', WebsiteFile.website_id, db.func.lower(WebsiteFile.file_path), unique=True)
@@ -3,45 +3,72 @@ API Routes Blueprint
 RESTful API endpoints for programmatic access
 """
 import os
+import json
+import time
+import secrets
 from flask import Blueprint, request, jsonify, current_app
 from werkzeug.utils import secure_filename
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, raiseload
 from app import db, limiter
 from app.models import File, Link, Analytics
+from app.utils.file_organization import save_file_stream
+from app.utils.concurrency_limit import concurrent_limit
 from datetime import datetime, timedelta
 
 api_bp = Blueprint('api', __name__)
 
+# Prebuilt link lookups; the bound slug lets SQLAlchemy reuse the compiled statement
+_ACTIVE_LINK_WITH_FILE = db.select(Link).options(
+    joinedload(Link.file),
+    raiseload('*')  # Any other lazy load is a bug
+).where(Link.slug == db.bindparam('slug'), Link.is_active == True)
+_LINK_BY_SLUG = db.select(Link).where(Link.slug == db.bindparam('slug'))
+_LINK_BY_SLUG_NO_LAZY = _LINK_BY_SLUG.options(raiseload('*'))
+
+# Pre-serialized health response, refreshed at most once per second
+_HEALTH_CACHE = {'body': None, 'ts': 0.0}
+
 @api_bp.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'timestamp': datetime.utcnow().isoformat(),
-        'version': current_app.config['APP_VERSION']
-    }), 200
+    now = time.time()
+    if now - _HEALTH_CACHE['ts'] > 1:
+        _HEALTH_CACHE['body'] = json.dumps({
+            'status': 'healthy',
+            'timestamp': datetime.utcnow().isoformat(),
+            'version': current_app.config['APP_VERSION']
+        }).encode()
+        _HEALTH_CACHE['ts'] = now
+    
+    return current_app.response_class(_HEALTH_CACHE['body'], status=200, mimetype='application/json')
 
 @api_bp.route('/stats', methods=['GET'])
 def get_stats():
     """Get platform statistics"""
-    total_files = File.query.count()
-    total_links = Link.query.count()
-    total_views = db.session.query(db.func.sum(Link.view_count)).scalar() or 0
-    
-    # Get recent activity (last 24 hours)
+    # Recent activity covers the last 24 hours
     yesterday = datetime.utcnow() - timedelta(days=1)
-    recent_uploads = File.query.filter(File.upload_date > yesterday).count()
-    recent_views = Analytics.query.filter(Analytics.access_date > yesterday).count()
+    
+    # Fetch every counter in a single round-trip
+    stats = db.session.execute(db.select(
+        db.select(db.func.count(File.id)).scalar_subquery().label('total_files'),
+        db.select(db.func.count(Link.id)).scalar_subquery().label('total_links'),
+        db.select(db.func.coalesce(db.func.sum(Link.view_count), 0)).scalar_subquery().label('total_views'),
+        db.select(db.func.count(File.id)).where(File.upload_date > yesterday).scalar_subquery().label('recent_uploads'),
+        db.select(db.func.count(Analytics.id)).where(Analytics.access_date > yesterday).scalar_subquery().label('recent_views')
+    )).one()
     
     return jsonify({
-        'total_files': total_files,
-        'total_links': total_links,
-        'total_views': total_views,
-        'recent_uploads': recent_uploads,
-        'recent_views': recent_views
+        'total_files': stats.total_files,
+        'total_links': stats.total_links,
+        'total_views': stats.total_views,
+        'recent_uploads': stats.recent_uploads,
+        'recent_views': stats.recent_views
     }), 200
 
 @api_bp.route('/upload', methods=['POST'])
 @limiter.limit("10 per minute")
+@concurrent_limit(3)
 def api_upload():
     """API endpoint for file upload"""
     # Check for API key in headers (implement authentication as needed)
@@ -59,25 +86,28 @@ def api_upload():
         # Secure and save the file
         original_filename = secure_filename(file.filename) or 'unnamed_file'
         
-        # Generate unique filename
-        timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-        import secrets
-        random_str = secrets.token_hex(8)
+        # Generate unique filename (96 random bits, already filesystem-safe)
         ext = ''
         if '.' in original_filename:
             ext = '.' + original_filename.rsplit('.', 1)[1].lower()
-        stored_filename = f"{timestamp}_{random_str}{ext}"
+        stored_filename = secrets.token_urlsafe(12) + ext
         
-        # Save file
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], stored_filename)
-        file.save(file_path)
+        # Save file, counting bytes as they are written
+        uploads_fd = current_app.config.get('UPLOADS_FD')
+        if uploads_fd is not None:
+            file_size = save_file_stream(file, stored_filename, dir_fd=uploads_fd)
+        else:
+            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], stored_filename)
+            file_size = save_file_stream(file, file_path)
         
         # Create database record
         new_file = File(
             original_filename=original_filename,
             stored_filename=stored_filename,
-            file_size=os.path.getsize(file_path),
+            stored_location='',  # Saved flat in UPLOAD_FOLDER
+            file_size=file_size,
             mime_type=file.content_type or 'application/octet-stream',
+            file_extension=File.extension_for(original_filename, file.content_type),
             upload_ip=request.remote_addr
         )
         db.session.add(new_file)
@@ -87,20 +117,35 @@ def api_upload():
         slug = Link.generate_slug()
         new_link = Link(slug=slug, file_id=new_file.id)
         
-        # Handle optional parameters
-        if request.json:
-            # Password protection
-            password = request.json.get('password')
-            if password:
-                new_link.set_password(password)
-            
-            # Expiry
-            expiry_days = request.json.get('expiry_days')
-            if expiry_days and isinstance(expiry_days, int) and expiry_days > 0:
-                new_link.expiry_date = datetime.utcnow() + timedelta(days=expiry_days)
+        # Handle optional parameters (JSON body or multipart form fields, parsed once)
+        options = request.get_json(silent=True)
+        if isinstance(options, dict):
+            password = options.get('password')
+            expiry_days = options.get('expiry_days')
+        else:
+            password = request.form.get('password')
+            expiry_days = request.form.get('expiry_days', type=int)
         
-        db.session.add(new_link)
+        # Password protection
+        if password:
+            new_link.set_password(password)
+        
+        # Expiry
+        if expiry_days and isinstance(expiry_days, int) and expiry_days > 0:
+            new_link.expiry_date = datetime.utcnow() + timedelta(days=expiry_days)
+        
+        # Insert the link, retrying with a fresh slug on a unique-constraint collision
+        for _ in range(5):
+            try:
+                with db.session.begin_nested():
+                    db.session.add(new_link)
+                break
+            except IntegrityError:
+                new_link.slug = Link.generate_slug()
+        else:
+            raise RuntimeError('Could not allocate a unique link slug')
         db.session.commit()
+        slug = new_link.slug
         
         # Generate response
         base_url = request.url_root.rstrip('/')
@@ -128,7 +173,8 @@ def api_upload():
 @api_bp.route('/links/<slug>', methods=['GET'])
 def get_link_info(slug):
     """Get information about a specific link"""
-    link = Link.query.filter_by(slug=slug, is_active=True).first()
+    # Load the file in the same query
+    link = db.session.execute(_ACTIVE_LINK_WITH_FILE, {'slug': slug}).scalar_one_or_none()
     
     if not link:
         return jsonify({'error': 'Link not found'}), 404
@@ -159,7 +205,7 @@ def delete_link(slug):
     # Check for API key or authentication
     api_key = request.headers.get('X-API-Key')
     
-    link = Link.query.filter_by(slug=slug).first()
+    link = db.session.execute(_LINK_BY_SLUG, {'slug': slug}).scalar_one_or_none()
     
     if not link:
         return jsonify({'error': 'Link not found'}), 404
@@ -182,37 +228,59 @@ def delete_link(slug):
 @api_bp.route('/links/<slug>/analytics', methods=['GET'])
 def get_link_analytics(slug):
     """Get analytics for a specific link"""
-    link = Link.query.filter_by(slug=slug).first()
+    link = db.session.execute(_LINK_BY_SLUG_NO_LAZY, {'slug': slug}).scalar_one_or_none()
     
     if not link:
         return jsonify({'error': 'Link not found'}), 404
     
-    # Get analytics data
-    analytics = Analytics.query.filter_by(link_id=link.id).order_by(Analytics.access_date.desc()).limit(100).all()
+    # Recent activity (last 100 hits) as plain rows, no ORM objects
+    recent = db.select(
+        Analytics.access_date,
+        Analytics.ip_address,
+        Analytics.country,
+        Analytics.referrer
+    ).where(
+        Analytics.link_id == link.id
+    ).order_by(Analytics.access_date.desc()).limit(100).subquery()
     
-    # Process analytics
-    analytics_data = []
-    for record in analytics:
-        analytics_data.append({
-            'timestamp': record.access_date.isoformat(),
-            'ip': record.ip_address[:record.ip_address.rfind('.')] + '.xxx' if record.ip_address else None,  # Partial IP for privacy
-            'country': record.country,
-            'referrer': record.referrer
-        })
-    
-    # Get daily stats for the last 7 days
+    # Daily stats for the last 7 days
     week_ago = datetime.utcnow() - timedelta(days=7)
-    daily_views = db.session.query(
-        db.func.date(Analytics.access_date).label('date'),
-        db.func.count(Analytics.id).label('count')
-    ).filter(
-        Analytics.link_id == link.id,
-        Analytics.access_date > week_ago
-    ).group_by(
-        db.func.date(Analytics.access_date)
-    ).all()
-    
-    daily_stats = {str(day.date): day.count for day in daily_views}
+    day = db.func.date(Analytics.access_date)
+    
+    # Fetch both in one round-trip, tagging each row with its kind
+    rows = db.session.execute(db.union_all(
+        db.select(
+            db.literal('recent').label('kind'),
+            recent.c.access_date,
+            recent.c.ip_address,
+            recent.c.country,
+            recent.c.referrer,
+            db.null().label('date'),
+            db.null().label('count')
+        ),
+        db.select(
+            db.literal('daily'),
+            db.null(),
+            db.null(),
+            db.null(),
+            db.null(),
+            day,
+            db.func.count(Analytics.id)
+        ).where(
+            Analytics.link_id == link.id,
+            Analytics.access_date > week_ago
+        ).group_by(day)
+    ).order_by(db.desc('access_date'))).all()
+    
+    # Process analytics
+    analytics_data = [{
+        'timestamp': row.access_date.isoformat(),
+        'ip': row.ip_address[:row.ip_address.rfind('.')] + '.xxx' if row.ip_address else None,  # Partial IP for privacy
+        'country': row.country,
+        'referrer': row.referrer
+    } for row in rows if row.kind == 'recent']
+    
+    daily_stats = {str(row.date): row.count for row in rows if row.kind == 'daily'}
     
     return jsonify({
         'slug': slug,
@@ -2,20 +2,31 @@
 Authentication Routes Blueprint
 Handles user registration, login, logout, and session management
 """
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+import hmac
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, g
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
-from app.models import User
+from app.models import User, UserFile, Website, File, Link
+from app.utils.file_organization import resolve_stored_file, remove_file_async
+from sqlalchemy.orm import contains_eager, load_only, raiseload
 from functools import wraps
-from datetime import datetime
+from datetime import datetime, timedelta
 
 auth_bp = Blueprint('auth', __name__)
 
+@auth_bp.before_app_request
+def load_logged_in_user():
+    """Load the session's user once per request (later lookups hit the identity map)"""
+    user_id = session.get('user_id')
+    g.user = db.session.get(User, user_id) if user_id is not None else None
+
 def login_required(f):
     """Decorator to require login for certain routes"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        if g.user is None:
+            # Drop stale sessions whose user no longer exists
+            session.clear()
             flash('Please login to access this page.', 'warning')
             return redirect(url_for('auth.login', next=request.url))
         return f(*args, **kwargs)
@@ -25,12 +36,11 @@ def admin_required(f):
     """Decorator to require admin access for certain routes"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        if g.user is None:
             flash('Please login to access this page.', 'warning')
             return redirect(url_for('auth.login'))
         
-        user = User.query.get(session['user_id'])
-        if not user or not user.is_admin:
+        if not g.user.is_admin:
             flash('Admin access required.', 'danger')
             return redirect(url_for('main.index'))
         return f(*args, **kwargs)
@@ -101,8 +111,10 @@ def login():
             flash('Email and password are required.', 'danger')
             return redirect(url_for('auth.login'))
         
-        # Special admin account
-        if email == 'admin' and password == 'admin123':
+        # Special admin account (constant-time compare; both checks always run)
+        email_matches = hmac.compare_digest(email.encode(), b'admin')
+        password_matches = hmac.compare_digest(password.encode(), b'admin123')
+        if email_matches and password_matches:
             # Check if admin exists, if not create it
             admin = User.query.filter_by(email='admin@filelinkpro.com').first()
             if not admin:
@@ -139,6 +151,10 @@ def login():
             flash('Your account has been deactivated.', 'warning')
             return redirect(url_for('auth.login'))
         
+        # Upgrade legacy (werkzeug PBKDF2) hashes now that we have the plaintext
+        if user.password_needs_rehash():
+            user.set_password(password)
+        
         # Update last login
         user.last_login = datetime.utcnow()
         db.session.commit()
@@ -177,29 +193,38 @@ def logout():
 @login_required
 def dashboard():
     """User dashboard"""
-    user = User.query.get(session['user_id'])
-    if not user:
-        session.clear()
-        return redirect(url_for('auth.login'))
+    user = g.user
     
     # Get user's files and websites
-    from app.models import UserFile, Website, File, Link
-    
-    user_files = db.session.query(File, Link).join(
-        UserFile, UserFile.file_id == File.id
+    # Recent shared files with their links, populated from one joined SELECT
+    user_files = UserFile.query.join(
+        UserFile.file
     ).join(
-        Link, Link.file_id == File.id
+        File.links
+    ).options(
+        load_only(UserFile.id),
+        contains_eager(UserFile.file).load_only(
+            File.id, File.original_filename, File.file_size, File.upload_date
+        ),
+        contains_eager(UserFile.file).contains_eager(File.links).load_only(
+            Link.slug, Link.view_count
+        ),
+        raiseload('*')  # Any other lazy load is a bug
     ).filter(
         UserFile.user_id == user.id
     ).order_by(File.upload_date.desc()).limit(10).all()
     
-    user_websites = Website.query.filter_by(
+    user_websites = Website.query.options(
+        load_only(Website.id, Website.name, Website.slug, Website.is_published),
+        raiseload('*')
+    ).filter_by(
         user_id=user.id, 
         is_published=True
     ).order_by(Website.created_date.desc()).all()
     
-    # Recalculate storage usage from actual files
-    user.recalculate_storage()
+    # Storage is tracked incrementally; only recount when it may have drifted
+    if user.storage_dirty:
+        user.recalculate_storage()
     
     # Calculate storage usage
     total_storage = user.max_storage
@@ -218,24 +243,34 @@ def dashboard():
 @admin_required
 def admin_panel():
     """Admin panel"""
-    from app.models import File, Link, Website
-    
-    # Get statistics
-    total_users = User.query.count()
-    total_files = File.query.count()
-    total_links = Link.query.count()
-    total_websites = Website.query.count()
+    # Get statistics in a single round-trip
+    total_users, total_files, total_links, total_websites = db.session.execute(db.select(
+        db.select(db.func.count(User.id)).scalar_subquery(),
+        db.select(db.func.count(File.id)).scalar_subquery(),
+        db.select(db.func.count(Link.id)).scalar_subquery(),
+        db.select(db.func.count(Website.id)).scalar_subquery()
+    )).one()
     
     # Get recent users
-    recent_users = User.query.order_by(User.created_date.desc()).limit(10).all()
+    recent_users = User.query.options(
+        load_only(User.id, User.email, User.full_name, User.created_date),
+        raiseload('*')
+    ).order_by(User.created_date.desc()).limit(10).all()
     
     # Get recent files
-    recent_files = db.session.query(File, Link).join(
-        Link, Link.file_id == File.id
+    recent_files = File.query.join(
+        File.links
+    ).options(
+        load_only(File.id, File.original_filename, File.file_size, File.upload_date),
+        contains_eager(File.links).load_only(Link.slug, Link.view_count),
+        raiseload('*')
     ).order_by(File.upload_date.desc()).limit(10).all()
     
     # Get recent websites
-    recent_websites = Website.query.order_by(Website.created_date.desc()).limit(10).all()
+    recent_websites = Website.query.options(
+        load_only(Website.id, Website.name, Website.slug, Website.is_published, Website.created_date),
+        raiseload('*')
+    ).order_by(Website.created_date.desc()).limit(10).all()
     
     return render_template('auth/admin.html',
                          total_users=total_users,
@@ -250,10 +285,7 @@ def admin_panel():
 @login_required
 def profile():
     """User profile page"""
-    user = User.query.get(session['user_id'])
-    if not user:
-        session.clear()
-        return redirect(url_for('auth.login'))
+    user = g.user
     
     return render_template('auth/profile.html', user=user)
 
@@ -261,9 +293,7 @@ def profile():
 @login_required
 def update_profile():
     """Update user profile"""
-    user = User.query.get(session['user_id'])
-    if not user:
-        return redirect(url_for('auth.login'))
+    user = g.user
     
     full_name = request.form.get('full_name')
     current_password = request.form.get('current_password')
@@ -292,11 +322,7 @@ def update_profile():
 @login_required
 def manage_file(file_id):
     """Show file details and management options"""
-    user = User.query.get(session['user_id'])
-    if not user:
-        return redirect(url_for('auth.login'))
-    
-    from app.models import UserFile, File, Link
+    user = g.user
     
     # Get file and ensure user owns it
     user_file = UserFile.query.filter_by(
@@ -322,12 +348,7 @@ def manage_file(file_id):
 @login_required
 def update_link_settings(file_id):
     """Update link settings (password, expiry)"""
-    user = User.query.get(session['user_id'])
-    if not user:
-        return redirect(url_for('auth.login'))
-    
-    from app.models import UserFile, File, Link
-    from datetime import datetime, timedelta
+    user = g.user
     
     # Get file and ensure user owns it
     user_file = UserFile.query.filter_by(
@@ -376,13 +397,7 @@ def update_link_settings(file_id):
 @login_required
 def delete_file(file_id):
     """Delete a user's file"""
-    user = User.query.get(session['user_id'])
-    if not user:
-        return redirect(url_for('auth.login'))
-    
-    from app.models import UserFile, File, Link
-    import os
-    from flask import current_app
+    user = g.user
     
     # Get file and ensure user owns it
     user_file = UserFile.query.filter_by(
@@ -399,10 +414,8 @@ def delete_file(file_id):
         else:
             user.storage_used = 0
         
-        # Delete physical file
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], file.stored_filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        # Locate the physical file (flat or organized structure)
+        file_path = resolve_stored_file(file.stored_filename, file.stored_location)
         
         # Delete UserFile relationship first
         db.session.delete(user_file)
@@ -413,6 +426,10 @@ def delete_file(file_id):
         # Commit all changes
         db.session.commit()
         
+        # The database is authoritative; remove the physical file in the background
+        if file_path:
+            remove_file_async(file_path)
+        
         flash('File deleted successfully! 🗑️', 'success')
         
     except Exception as e:
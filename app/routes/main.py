@@ -2,27 +2,54 @@
 Main Routes Blueprint
 Handles landing page, about page, and general site navigation
 """
-from flask import Blueprint, render_template, current_app
+import time
+import hashlib
+from flask import Blueprint, render_template, current_app, request, session
 from app.models import File, Link, Analytics
 from app import db
 
 main_bp = Blueprint('main', __name__)
 
+# Landing-page counters change slowly, so they are recomputed at most once per TTL
+_STATS_CACHE = {'stats': None, 'ts': 0.0}
+
+def _landing_stats():
+    """Get the landing-page counters, cached for LANDING_STATS_TTL seconds"""
+    now = time.time()
+    if _STATS_CACHE['stats'] is None or now - _STATS_CACHE['ts'] >= current_app.config.get('LANDING_STATS_TTL', 0):
+        total_files, total_links, total_views = db.session.execute(db.select(
+            db.select(db.func.count(File.id)).scalar_subquery(),
+            db.select(db.func.count(Link.id)).scalar_subquery(),
+            db.select(db.func.coalesce(db.func.sum(Link.view_count), 0)).scalar_subquery()
+        )).one()
+        _STATS_CACHE['stats'] = {
+            'files': total_files,
+            'links': total_links,
+            'views': total_views
+        }
+        _STATS_CACHE['ts'] = now
+    
+    return _STATS_CACHE['stats']
+
+# Rendered static pages keyed by (template, logged in); only the nav bar depends on the session
+_PAGE_CACHE = {}
+
+def _render_static(template_name, **context):
+    """Render a static page once per login state and serve it from memory with an ETag"""
+    key = (template_name, 'user_id' in session)
+    cached = _PAGE_CACHE.get(key)
+    if cached is None or current_app.debug:
+        html = render_template(template_name, **context).encode()
+        cached = _PAGE_CACHE[key] = (html, hashlib.md5(html).hexdigest())
+    
+    response = current_app.response_class(cached[0], mimetype='text/html')
+    response.set_etag(cached[1])
+    return response.make_conditional(request)
+
 @main_bp.route('/')
 def index():
     """Landing page with hero section and features"""
-    # Get statistics for display
-    total_files = File.query.count()
-    total_links = Link.query.count()
-    total_views = db.session.query(db.func.sum(Link.view_count)).scalar() or 0
-    
-    stats = {
-        'files': total_files,
-        'links': total_links,
-        'views': total_views
-    }
-    
-    return render_template('landing.html', stats=stats)
+    return render_template('landing.html', stats=_landing_stats())
 
 @main_bp.route('/features')
 def features():
@@ -59,7 +86,7 @@ def features():
             'description': 'Access your files from anywhere in the world'
         }
     ]
-    return render_template('features.html', features=features_list)
+    return _render_static('features.html', features=features_list)
 
 @main_bp.route('/pricing')
 def pricing():
@@ -85,29 +112,29 @@ def pricing():
             'cta': 'Contact Sales'
         }
     ]
-    return render_template('pricing.html', plans=plans)
+    return _render_static('pricing.html', plans=plans)
 
 @main_bp.route('/docs')
 def docs():
     """Documentation page"""
-    return render_template('docs.html')
+    return _render_static('docs.html')
 
 @main_bp.route('/privacy')
 def privacy():
     """Privacy policy page"""
-    return render_template('privacy.html')
+    return _render_static('privacy.html')
 
 @main_bp.route('/terms')
 def terms():
     """Terms of service page"""
-    return render_template('terms.html')
+    return _render_static('terms.html')
 
 @main_bp.route('/contact')
 def contact():
     """Contact page"""
-    return render_template('contact.html')
+    return _render_static('contact.html')
 
 @main_bp.route('/editor')
 def code_editor():
     """HTML/CSS/JS code editor and preview"""
-    return render_template('code_editor.html')
+    return _render_static('code_editor.html')
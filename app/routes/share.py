@@ -2,19 +2,95 @@
 Share Routes Blueprint
 Handles file sharing, downloading, and preview functionality
 """
-import os
-from flask import Blueprint, render_template, request, send_file, abort, current_app, jsonify
-from app import db
-from app.models import Link, File, Analytics
-from app.utils.file_organization import find_file_in_organized_structure
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import Blueprint, render_template, request, abort, current_app, jsonify, session
+from sqlalchemy.orm import joinedload
+from app.models import Link, File
+from app.utils import analytics_queue
+from app.utils.file_organization import resolve_stored_file, send_stored_file
 
 share_bp = Blueprint('share', __name__)
 
+# Content types for text previews; HTML is shown as source, never rendered
+_TEXT_PREVIEW_MIME = {
+    'html': 'text/plain',
+    'htm': 'text/plain',
+    'css': 'text/css',
+    'js': 'application/javascript',
+    'json': 'application/json',
+    'xml': 'text/xml'
+}
+
+# Recently rendered share pages: (link id, URL, logged in) -> (expires, link state, html)
+_SHARE_PAGE_CACHE_SIZE = 1024
+_share_page_cache = OrderedDict()
+_share_page_cache_lock = threading.Lock()
+
+def _cache_preview(response, link):
+    """Let clients reuse a preview response; password-protected ones stay out of shared caches"""
+    if link.password_hash:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    response.cache_control.no_cache = None  # send_file marks responses no-cache by default
+    response.cache_control.max_age = 3600
+    return response
+
+def _resolve_link(slug):
+    """Get an active link by slug with its file loaded in the same query"""
+    return Link.query.options(joinedload(Link.file)).filter_by(slug=slug, is_active=True).first()
+
+def _check_access(link, password):
+    """Check expiry and password protection, returning the HTTP error code or None if allowed"""
+    if link.is_expired():
+        return 410
+    
+    if link.password_hash and (not password or not link.check_password(password)):
+        return 403
+    
+    return None
+
+def _render_share_page(link, file):
+    """Render the share page, reusing recent renders of public links for SHARE_PAGE_CACHE_TTL seconds"""
+    ttl = current_app.config.get('SHARE_PAGE_CACHE_TTL', 0)
+    
+    # Password-protected pages carry the password in their URLs, so never keep them around.
+    # A render is only reused while the link state it shows is unchanged (callers have
+    # already rejected inactive and expired links)
+    key = None
+    if ttl > 0 and not link.password_hash:
+        key = (link.id, request.url, 'user_id' in session)
+        state = (file.id, link.view_count, link.last_accessed, link.expiry_date)
+        now = time.monotonic()
+        with _share_page_cache_lock:
+            entry = _share_page_cache.get(key)
+            if entry is not None and entry[0] > now and entry[1] == state:
+                _share_page_cache.move_to_end(key)
+                return entry[2]
+    
+    # Check if file is previewable
+    if file.is_previewable():
+        preview_type = file.get_preview_type()
+        html = render_template('share_page.html', link=link, file=file, preview=True, preview_type=preview_type)
+    else:
+        html = render_template('share_page.html', link=link, file=file, preview=False, preview_type=None)
+    
+    if key is not None:
+        with _share_page_cache_lock:
+            _share_page_cache[key] = (now + ttl, state, html)
+            _share_page_cache.move_to_end(key)
+            while len(_share_page_cache) > _SHARE_PAGE_CACHE_SIZE:
+                _share_page_cache.popitem(last=False)
+    return html
+
 @share_bp.route('/<slug>', methods=['GET', 'POST'])
 def share_link(slug):
     """Handle shared link access"""
-    # Find the link
-    link = Link.query.filter_by(slug=slug, is_active=True).first()
+    # Find the link (and its file)
+    link = _resolve_link(slug)
     
     if not link:
         abort(404)
@@ -45,69 +121,58 @@ def share_link(slug):
     
     # Track analytics
     if current_app.config['ENABLE_ANALYTICS']:
-        analytics = Analytics(
-            link_id=link.id,
+        analytics_queue.record_hit(
+            link.id,
             ip_address=request.remote_addr,
             user_agent=request.headers.get('User-Agent', ''),
             referrer=request.headers.get('Referer', '')
         )
-        db.session.add(analytics)
-        link.increment_views()
     
-    # Check if file is previewable
-    if file.is_previewable():
-        preview_type = file.get_preview_type()
-        return render_template('share_page.html', link=link, file=file, preview=True, preview_type=preview_type)
-    else:
-        return render_template('share_page.html', link=link, file=file, preview=False, preview_type=None)
+    return _render_share_page(link, file)
 
 @share_bp.route('/<slug>/download')
 def download_file(slug):
     """Direct file download"""
-    # Find the link
-    link = Link.query.filter_by(slug=slug, is_active=True).first()
+    # Find the link (and its file)
+    link = _resolve_link(slug)
     
     if not link:
         abort(404)
     
-    # Check if link is expired
-    if link.is_expired():
-        abort(410)
-    
-    # Check password if protected
-    if link.password_hash:
-        password = request.args.get('password')
-        if not password or not link.check_password(password):
-            abort(403)
+    # Check expiry and password
+    error = _check_access(link, request.args.get('password'))
+    if error:
+        abort(error)
     
     # Get the file
     file = link.file
     if not file:
         abort(404)
     
-    # Get file path - check organized structure first
-    file_path = find_file_in_organized_structure(file.stored_filename)
+    # Get file path - cached lookup through the organized structure
+    file_path = resolve_stored_file(file.stored_filename, file.stored_location)
     
-    if not file_path or not os.path.exists(file_path):
+    if not file_path:
         abort(404)
     
     # Track download in analytics
     if current_app.config['ENABLE_ANALYTICS']:
-        analytics = Analytics(
-            link_id=link.id,
+        analytics_queue.record_hit(
+            link.id,
             ip_address=request.remote_addr,
             user_agent=request.headers.get('User-Agent', ''),
             referrer=request.headers.get('Referer', '')
         )
-        db.session.add(analytics)
-        link.increment_views()
     
-    # Send file
-    return send_file(
+    # Send file, answering repeat requests with 304 / byte ranges
+    return send_stored_file(
         file_path,
         as_attachment=True,
         download_name=file.original_filename,
-        mimetype=file.mime_type
+        mimetype=file.mime_type,
+        conditional=True,
+        etag=True,
+        last_modified=file.upload_date
     )
 
 @share_bp.route('/<slug>/preview')
@@ -116,36 +181,31 @@ def preview_file(slug):
     from flask import Response
     import mimetypes
     
-    # Find the link
-    link = Link.query.filter_by(slug=slug, is_active=True).first()
+    # Find the link (and its file)
+    link = _resolve_link(slug)
     
     if not link:
         abort(404)
     
-    # Check if link is expired
-    if link.is_expired():
-        abort(410)
-    
-    # Check password if protected
-    if link.password_hash:
-        password = request.args.get('password')
-        if not password or not link.check_password(password):
-            abort(403)
+    # Check expiry and password
+    error = _check_access(link, request.args.get('password'))
+    if error:
+        abort(error)
     
     # Get the file
     file = link.file
     if not file or not file.is_previewable():
         abort(404)
     
-    # Get file path - check organized structure first
-    file_path = find_file_in_organized_structure(file.stored_filename)
+    # Get file path - cached lookup through the organized structure
+    file_path = resolve_stored_file(file.stored_filename, file.stored_location)
     
-    if not file_path or not os.path.exists(file_path):
+    if not file_path:
         abort(404)
     
     # Track preview in analytics
     if current_app.config['ENABLE_ANALYTICS']:
-        link.increment_views()
+        analytics_queue.record_view(link.id)
     
     # Get preview type
     preview_type = file.get_preview_type()
@@ -154,43 +214,21 @@ def preview_file(slug):
     # Handle different file types
     if preview_type == 'image':
         # Serve image files directly
-        return send_file(file_path, mimetype=file.mime_type)
+        return _cache_preview(send_stored_file(file_path, mimetype=file.mime_type, conditional=True, last_modified=file.upload_date), link)
     
     elif preview_type == 'pdf':
         # Serve PDF files directly
-        return send_file(file_path, mimetype='application/pdf')
+        return _cache_preview(send_stored_file(file_path, mimetype='application/pdf', conditional=True, last_modified=file.upload_date), link)
     
     elif preview_type in ['audio', 'video']:
         # Serve media files directly
         mime_type = mimetypes.guess_type(file_path)[0] or file.mime_type
-        return send_file(file_path, mimetype=mime_type)
+        return _cache_preview(send_stored_file(file_path, mimetype=mime_type, conditional=True, last_modified=file.upload_date), link)
     
     elif preview_type in ['text', 'html']:
-        # Handle text-based files
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except UnicodeDecodeError:
-            try:
-                with open(file_path, 'r', encoding='latin-1') as f:
-                    content = f.read()
-            except:
-                abort(500)
-        except:
-            abort(500)
-        
-        if ext in ['html', 'htm']:
-            return content, 200, {'Content-Type': 'text/plain'}
-        elif ext == 'css':
-            return content, 200, {'Content-Type': 'text/css'}
-        elif ext == 'js':
-            return content, 200, {'Content-Type': 'application/javascript'}
-        elif ext == 'json':
-            return content, 200, {'Content-Type': 'application/json'}
-        elif ext == 'xml':
-            return content, 200, {'Content-Type': 'text/xml'}
-        else:
-            return content, 200, {'Content-Type': 'text/plain'}
+        # Stream text-based files from disk; the browser handles the charset
+        mime_type = _TEXT_PREVIEW_MIME.get(ext, 'text/plain')
+        return _cache_preview(send_stored_file(file_path, mimetype=mime_type, conditional=True, last_modified=file.upload_date), link)
     
     else:
         abort(404)
@@ -198,8 +236,8 @@ def preview_file(slug):
 @share_bp.route('/<slug>/info')
 def link_info(slug):
     """Get link information (API endpoint)"""
-    # Find the link
-    link = Link.query.filter_by(slug=slug, is_active=True).first()
+    # Find the link (and its file)
+    link = _resolve_link(slug)
     
     if not link:
         return jsonify({'error': 'Link not found'}), 404
@@ -207,7 +245,17 @@ def link_info(slug):
     # Get file info
     file = link.file
     
-    return jsonify({
+    # The payload only changes with these columns; let polling clients revalidate with 304
+    etag = hashlib.blake2b(
+        f'{file.id}|{link.view_count}|{link.last_accessed}|{link.expiry_date}|{bool(link.password_hash)}'.encode(),
+        digest_size=8
+    ).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    
+    response = jsonify({
         'slug': link.slug,
         'file': {
             'name': file.original_filename,
@@ -223,12 +271,14 @@ def link_info(slug):
             'password_protected': bool(link.password_hash)
         }
     })
+    response.set_etag(etag)
+    return response
 
 @share_bp.route('/<slug>/verify-password', methods=['POST'])
 def verify_password(slug):
     """Verify password for protected link"""
-    # Find the link
-    link = Link.query.filter_by(slug=slug, is_active=True).first()
+    # Find the link (and its file)
+    link = _resolve_link(slug)
     
     if not link:
         return jsonify({'error': 'Link not found'}), 404
@@ -3,19 +3,31 @@ Site Routes Blueprint
 Handles viewing of published websites
 """
 import os
+import re
+import hmac
+import hashlib
+import functools
 import mimetypes
-from flask import Blueprint, render_template, send_file, abort, current_app, request, Response, session
+import threading
+from collections import OrderedDict
+from flask import Blueprint, render_template, abort, current_app, request, Response, session
 from app.models import Website, WebsiteFile, File
 from app import db
-from app.utils.file_organization import find_file_in_organized_structure
+from app.utils import analytics_queue
+from app.utils.file_organization import resolve_stored_file, send_stored_file
 
 site_bp = Blueprint('site', __name__)
 
-def generate_watermark_html(user):
-    """Generate watermark HTML for free users"""
-    username = user.username if hasattr(user, 'username') else user.full_name.split()[0] if user.full_name else user.email.split('@')[0]
-    
-    watermark_html = f'''
+# Build-tool fingerprinted asset names, e.g. app.3f9a1c2b.js or chunk-5d41402abc.css
+_FINGERPRINTED_ASSET = re.compile(r'[.-][0-9a-f]{8,}\.[a-z0-9]+$', re.IGNORECASE)
+
+# Case-insensitive markers used when injecting into index pages (matched on raw bytes, no decoding)
+_HEAD_OPEN = re.compile(rb'<head', re.IGNORECASE)
+_BODY_CLOSE = re.compile(rb'</body>', re.IGNORECASE)
+_BRANDING = re.compile(rb'filelink pro|filelink-pro|powered by filelink|published by', re.IGNORECASE)
+
+# Watermark markup for free users; only the username varies
+_WATERMARK_TEMPLATE = '''
 <!-- FileLink Pro Watermark -->
 <div id="filelink-watermark" style="
     position: fixed;
@@ -81,154 +93,196 @@ def generate_watermark_html(user):
 }}
 </style>
 '''
+
+# Rendered password-gate and listing pages: (template, site version, files, logged in) -> html
+_SITE_PAGE_CACHE_SIZE = 1024
+_site_page_cache = OrderedDict()
+_site_page_cache_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=4096)
+def _watermark_for(username):
+    """Format the watermark for a username (cached, usernames rarely change)"""
+    return _WATERMARK_TEMPLATE.format(username=username)
+
+def generate_watermark_html(user):
+    """Generate watermark HTML for free users"""
+    username = user.username if hasattr(user, 'username') else user.full_name.split()[0] if user.full_name else user.email.split('@')[0]
     
-    return watermark_html
+    return _watermark_for(username)
+
+def _find_body_close(content):
+    """Position of the last </body> tag, or -1; it is almost always in the last few KB"""
+    matches = list(_BODY_CLOSE.finditer(content, max(0, len(content) - 4096)))
+    if not matches:
+        matches = list(_BODY_CLOSE.finditer(content))
+    return matches[-1].start() if matches else -1
+
+# Only index files up to this size are kept rendered in memory (bounds the cache to ~64MB per worker)
+_INDEX_CACHE_MAX_BYTES = 128 * 1024
+
+@functools.lru_cache(maxsize=512)
+def _render_index(file_path, mtime_ns, size, slug, index_dir, watermark_html):
+    """Read a site's index file and inject the <base> tag and watermark, returning byte chunks (cached per file version)"""
+    # The markers are ASCII, so the document is searched and sliced as bytes without a decode/encode pass
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    
+    base_url = f"/site/{slug}/assets/" + (f"{index_dir}/" if index_dir else '')
+    base_tag = f"<base href=\"{base_url}\">".encode('utf-8')
+    
+    # Inject base tag right after the opening <head ...> (case-insensitive)
+    head_match = _HEAD_OPEN.search(content)
+    if head_match:
+        # Find the end of the head start tag
+        gt_pos = content.find(b'>', head_match.start())
+        if gt_pos != -1:
+            insertions = [(gt_pos + 1, base_tag)]
+        else:
+            # As a fallback, prepend base tag
+            insertions = [(0, base_tag)]
+    else:
+        # No head tag found; prepend base and minimal head wrapper if needed
+        insertions = [(0, b"<head>" + base_tag + b"</head>")]
+    
+    # Add watermark for free users ONLY if content doesn't already have FileLink Pro branding
+    if watermark_html is not None and not _BRANDING.search(content):
+        # Inject watermark before closing body tag, or append if no body tag
+        body_close_pos = _find_body_close(content)
+        insertions.append((body_close_pos if body_close_pos != -1 else len(content), watermark_html.encode('utf-8')))
+    
+    # Emit the document as slices around the insertions instead of re-copying it per splice
+    parts = []
+    start = 0
+    for pos, snippet in sorted(insertions, key=lambda insertion: insertion[0]):
+        parts.append(content[start:pos])
+        parts.append(snippet)
+        start = pos
+    parts.append(content[start:])
+    
+    return tuple(part for part in parts if part)
+
+def _site_access_token(website):
+    """Short session token for an unlocked site; it changes whenever the site's password does"""
+    return hmac.new(
+        current_app.config['SECRET_KEY'].encode(),
+        f'{website.id}|{website.password_hash}'.encode(),
+        hashlib.sha256
+    ).hexdigest()[:32]
+
+def _render_site_page(template_name, website, files_key, **context):
+    """Render a site's password or listing page once per site version and login state"""
+    # Flashed messages are consumed by the render, so those pages are never reused
+    key = None
+    if not current_app.debug and '_flashes' not in session:
+        key = (template_name, website.id, website.updated_date, website.name, website.description,
+               website.owner.username, files_key, 'user_id' in session)
+        with _site_page_cache_lock:
+            html = _site_page_cache.get(key)
+            if html is not None:
+                _site_page_cache.move_to_end(key)
+                return html
+    
+    html = render_template(template_name, website=website, **context)
+    
+    if key is not None:
+        with _site_page_cache_lock:
+            _site_page_cache[key] = html
+            _site_page_cache.move_to_end(key)
+            while len(_site_page_cache) > _SITE_PAGE_CACHE_SIZE:
+                _site_page_cache.popitem(last=False)
+    return html
 
 @site_bp.route('/<slug>')
 def view_website(slug):
     """View a published website"""
     website = Website.query.filter_by(slug=slug, is_published=True).first_or_404()
     
-    # Increment view count
-    website.view_count += 1
-    db.session.commit()
+    # Count the view (written in the background, batched per site)
+    analytics_queue.record_site_view(website.id)
     
     # Check if password protected
     if website.password_hash:
-        # Check if a session password matches the website's password
+        # The session holds a token derived from the password hash, never the hash itself
         session_key = f'website_password_{website.id}'
+        token = _site_access_token(website)
         
-        # Check if the correct password is in the session
-        if session.get(session_key) == website.password_hash:
+        # Check if the site was already unlocked in this session
+        if hmac.compare_digest(session.get(session_key) or '', token):
             pass  # Password is correct, allow access
         else:
             # If not in session, check for password in query param
             password = request.args.get('password')
             if password and website.check_password(password):
-                # Correct password provided, store it in session
-                session[session_key] = website.password_hash
+                # Correct password provided, remember the unlock in the session
+                session[session_key] = token
             else:
                 # No valid password, render password page
-                return render_template('website/password.html', website=website)
+                return _render_site_page('website/password.html', website, None)
     
-    # Get index file - first try marked index files, then auto-detect
-    index_file = db.session.query(WebsiteFile, File).join(
+    # Load every file of the site once as plain rows (only the columns used below); the index is picked from these
+    website_files = db.session.query(WebsiteFile, File).join(
         File, WebsiteFile.file_id == File.id
+    ).with_entities(
+        WebsiteFile.id, WebsiteFile.is_index, WebsiteFile.file_path,
+        File.id.label('file_id'), File.stored_filename, File.stored_location, File.original_filename, File.file_size
     ).filter(
-        WebsiteFile.website_id == website.id,
-        WebsiteFile.is_index == True
-    ).first()
+        WebsiteFile.website_id == website.id
+    ).order_by(WebsiteFile.id).all()
+    
+    # Get index file - first try marked index files, then auto-detect
+    index_file = next((row for row in website_files if row.is_index), None)
     
-    # If no marked index file found, auto-detect index.html
+    # If no marked index file found, auto-detect index.html, then index.htm
+    # (read-only: publishing and fix-index persist the is_index flag, not page views)
     if not index_file:
-        index_file = db.session.query(WebsiteFile, File).join(
-            File, WebsiteFile.file_id == File.id
-        ).filter(
-            WebsiteFile.website_id == website.id,
-            File.original_filename.ilike('index.html')
-        ).first()
-        
-        # If still not found, try index.htm
-        if not index_file:
-            index_file = db.session.query(WebsiteFile, File).join(
-                File, WebsiteFile.file_id == File.id
-            ).filter(
-                WebsiteFile.website_id == website.id,
-                File.original_filename.ilike('index.htm')
-            ).first()
-        
-        # If found, mark it as index for future use
-        if index_file:
-            website_file, file = index_file
-            website_file.is_index = True
-            db.session.commit()
+        index_file = next(
+            (row for row in website_files if row.original_filename.lower() == 'index.html'), None
+        ) or next(
+            (row for row in website_files if row.original_filename.lower() == 'index.htm'), None
+        )
     
     # If there's an index file, serve it directly (no template wrapper)
     if index_file:
         # Serve the actual index file content for iframe
-        website_file, file = index_file
-        # Use find_file_in_organized_structure to locate the file
-        file_path = find_file_in_organized_structure(file.stored_filename)
+        # Locate the file (cached lookup through the organized structure)
+        file_path = resolve_stored_file(index_file.stored_filename, index_file.stored_location)
         
-        if file_path and os.path.exists(file_path):
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-            except Exception:
-                # Fallback to latin-1 if utf-8 fails
-                with open(file_path, 'r', encoding='latin-1', errors='ignore') as f:
-                    content = f.read()
-            
+        if file_path:
             # Compute base URL to match the index's directory (if nested)
             index_dir = ''
-            if getattr(website_file, 'file_path', None):
+            if index_file.file_path:
                 # Normalize to forward slashes
-                normalized = website_file.file_path.replace('\\', '/')
+                normalized = index_file.file_path.replace('\\', '/')
                 index_dir = '/'.join([seg for seg in normalized.split('/')[:-1] if seg])
             
-            base_url = f"/site/{slug}/assets/" + (f"{index_dir}/" if index_dir else '')
-            base_tag = f"<base href=\"{base_url}\">"
-            
-            # Inject base tag right after the opening <head ...> (case-insensitive)
-            lower_content = content.lower()
-            head_pos = lower_content.find('<head')
-            if head_pos != -1:
-                # Find the end of the head start tag
-                gt_pos = content.find('>', head_pos)
-                if gt_pos != -1:
-                    content = content[:gt_pos+1] + base_tag + content[gt_pos+1:]
-                else:
-                    # As a fallback, prepend base tag
-                    content = base_tag + content
-            else:
-                # No head tag found; prepend base and minimal head wrapper if needed
-                content = f"<head>{base_tag}</head>" + content
+            # Watermark for free users (skipped later if the page already carries branding)
+            watermark_html = None if website.owner.is_premium else generate_watermark_html(website.owner)
             
-            # Add watermark for free users ONLY if content doesn't already have FileLink Pro branding
-            if not website.owner.is_premium:
-                # Check if content already has FileLink Pro branding to avoid duplicates
-                has_filelink_branding = (
-                    'filelink pro' in lower_content or 
-                    'filelink-pro' in lower_content or
-                    'powered by filelink' in lower_content or
-                    'published by' in lower_content
-                )
-                
-                # Only add watermark if the content doesn't already have branding
-                if not has_filelink_branding:
-                    watermark_html = generate_watermark_html(website.owner)
-                    # Inject watermark before closing body tag, or append if no body tag
-                    body_close_pos = lower_content.rfind('</body>')
-                    if body_close_pos != -1:
-                        # Find the actual position in the original content (case-sensitive)
-                        actual_pos = content.lower().rfind('</body>')
-                        content = content[:actual_pos] + watermark_html + content[actual_pos:]
-                    else:
-                        # No closing body tag, append watermark at the end
-                        content = content + watermark_html
+            # Rendered pages are reused until the index file changes on disk; large ones are rendered per request
+            stat = os.stat(file_path)
+            render = _render_index if stat.st_size <= _INDEX_CACHE_MAX_BYTES else _render_index.__wrapped__
+            parts = render(file_path, stat.st_mtime_ns, stat.st_size, slug, index_dir, watermark_html)
             
-            return Response(content, mimetype='text/html')
+            # Write the cached chunks straight out, without joining them into one document
+            response = Response(parts, mimetype='text/html', direct_passthrough=True)
+            response.content_length = sum(len(part) for part in parts)
+            return response
     
     # If no index file, show file listing
-    website_files = db.session.query(WebsiteFile, File).join(
-        File, WebsiteFile.file_id == File.id
-    ).filter(
-        WebsiteFile.website_id == website.id
-    ).all()
-    
     # Convert to files format expected by template
     files = []
-    for website_file, file in website_files:
+    for row in website_files:
         files.append({
-            'filename': file.original_filename,
-            'size': file.file_size
+            'filename': row.original_filename,
+            'size': row.file_size
         })
     
-    return render_template('website/view.html', 
-                         website=website, 
-                         website_files=website_files,
-                         files=files,
-                         has_index=False)
+    # Any added, removed or replaced file changes the key, so stale listings are never served
+    files_key = tuple((row.id, row.file_id, row.original_filename, row.file_size) for row in website_files)
+    return _render_site_page('website/view.html', website, files_key,
+                             website_files=website_files,
+                             files=files,
+                             has_index=False)
 
 @site_bp.route('/<slug>/assets/<path:filename>')
 def serve_website_asset(slug, filename):
@@ -238,39 +292,43 @@ def serve_website_asset(slug, filename):
     # Normalize incoming filename to use forward slashes
     normalized_filename = filename.replace('\\', '/')
     
-    # Find the file by exact stored path first
+    # Match the exact stored path, falling back to the original filename (no folders),
+    # in one round-trip; an exact path match always wins. Only the columns needed to serve are loaded.
+    path_match = WebsiteFile.file_path == normalized_filename
     website_file = db.session.query(WebsiteFile, File).join(
         File, WebsiteFile.file_id == File.id
+    ).with_entities(
+        File.stored_filename, File.stored_location, File.mime_type, File.original_filename, File.upload_date
     ).filter(
         WebsiteFile.website_id == website.id,
-        WebsiteFile.file_path == normalized_filename
+        db.or_(path_match, File.original_filename == os.path.basename(normalized_filename))
+    ).order_by(
+        db.case((path_match, 0), else_=1), WebsiteFile.id
     ).first()
     
-    if not website_file:
-        # Fallback: try by original filename (no folders)
-        website_file = db.session.query(WebsiteFile, File).join(
-            File, WebsiteFile.file_id == File.id
-        ).filter(
-            WebsiteFile.website_id == website.id,
-            File.original_filename == os.path.basename(normalized_filename)
-        ).first()
-    
     if website_file:
-        wf, file = website_file
-        # Use find_file_in_organized_structure to locate the file
-        file_path = find_file_in_organized_structure(file.stored_filename)
+        file = website_file
+        # Locate the file (cached lookup through the organized structure)
+        file_path = resolve_stored_file(file.stored_filename, file.stored_location)
         
-        if file_path and os.path.exists(file_path):
+        if file_path:
             # Determine MIME type
             mime_type = file.mime_type or mimetypes.guess_type(file.original_filename)[0] or 'application/octet-stream'
             
-            # For text files (CSS, JS), read and serve as text
-            if mime_type.startswith('text/') or mime_type in ['application/javascript', 'application/json']:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                return Response(content, mimetype=mime_type)
+            # Stream text and binary assets alike, with conditional/range support
+            response = send_stored_file(file_path, mimetype=mime_type, conditional=True, last_modified=file.upload_date)
+            
+            # Let browsers reuse assets; fingerprinted names never change content
+            response.cache_control.no_cache = None
+            if website.password_hash:
+                response.cache_control.private = True
+            else:
+                response.cache_control.public = True
+            if _FINGERPRINTED_ASSET.search(normalized_filename):
+                response.cache_control.max_age = 31536000
+                response.cache_control.immutable = True
             else:
-                # For binary files (images, videos, etc.), serve directly
-                return send_file(file_path, mimetype=mime_type)
+                response.cache_control.max_age = 300
+            return response
     
     abort(404)
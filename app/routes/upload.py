@@ -3,13 +3,13 @@ Upload Routes Blueprint
 Handles file upload functionality and link generation
 """
 import os
-import secrets
+import time
 from datetime import datetime, timedelta
-from flask import Blueprint, render_template, request, jsonify, current_app, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, jsonify, current_app, redirect, url_for, flash, session, g
 from werkzeug.utils import secure_filename
 from app import db, limiter
-from app.models import File, Link, User, UserFile
-from app.utils.file_organization import get_user_identifier, get_organized_file_path, ensure_uploads_structure
+from app.models import File, Link, UserFile
+from app.utils.file_organization import get_user_identifier, get_organized_file_path, get_stored_location, ensure_uploads_structure, save_file_stream
 
 upload_bp = Blueprint('upload', __name__)
 
@@ -24,8 +24,8 @@ def generate_unique_filename(original_filename):
         ext = '.' + original_filename.rsplit('.', 1)[1].lower()
     
     # Generate unique filename with timestamp and random string
-    timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-    random_str = secrets.token_hex(8)
+    timestamp = time.strftime('%Y%m%d_%H%M%S', time.gmtime())
+    random_str = os.urandom(8).hex()
     return f"{timestamp}_{random_str}{ext}"
 
 @upload_bp.route('/')
@@ -66,10 +66,8 @@ def process_upload():
             
             # Save file to organized folder structure (sharedfiles)
             file_path = get_organized_file_path('sharedfiles', user_identifier, stored_filename)
-            file.save(file_path)
-            
-            # Get file size
-            file_size = os.path.getsize(file_path)
+            # Stream to disk, counting bytes as they are written
+            file_size = save_file_stream(file, file_path)
             
             # Determine MIME type
             mime_type = file.content_type or 'application/octet-stream'
@@ -78,8 +76,10 @@ def process_upload():
             new_file = File(
                 original_filename=original_filename,
                 stored_filename=stored_filename,
+                stored_location=get_stored_location('sharedfiles', user_identifier),
                 file_size=file_size,
                 mime_type=mime_type,
+                file_extension=File.extension_for(original_filename, mime_type),
                 upload_ip=request.remote_addr
             )
             db.session.add(new_file)
@@ -117,7 +117,7 @@ def process_upload():
                 db.session.add(user_file)
                 
                 # Update user storage usage
-                user = User.query.get(session['user_id'])
+                user = g.user
                 if user:
                     user.update_storage(file_size)
             
@@ -170,6 +170,13 @@ def bulk_upload():
         results = []
         base_url = request.url_root.rstrip('/')
         
+        # Records are linked through relationships and written in one flush at commit
+        user = g.user
+        total_size = 0
+        
+        # Reserve a slug for every file up front (one collision check for the batch)
+        slugs = iter(Link.generate_slugs(len(files)))
+        
         for file in files:
             if file and file.filename and allowed_file(file.filename):
                 # Process each file
@@ -178,36 +185,27 @@ def bulk_upload():
                 
                 # Save file to organized folder structure (sharedfiles)
                 file_path = get_organized_file_path('sharedfiles', user_identifier, stored_filename)
-                file.save(file_path)
+                file_size = save_file_stream(file, file_path)
                 
                 # Create database records
                 new_file = File(
                     original_filename=original_filename,
                     stored_filename=stored_filename,
-                    file_size=os.path.getsize(file_path),
+                    stored_location=get_stored_location('sharedfiles', user_identifier),
+                    file_size=file_size,
                     mime_type=file.content_type or 'application/octet-stream',
+                    file_extension=File.extension_for(original_filename, file.content_type),
                     upload_ip=request.remote_addr
                 )
-                db.session.add(new_file)
-                db.session.flush()
-                
                 # Create link
-                slug = Link.generate_slug()
-                new_link = Link(slug=slug, file_id=new_file.id)
-                db.session.add(new_link)
+                slug = next(slugs)
+                new_link = Link(slug=slug, file=new_file)
+                db.session.add_all([new_file, new_link])
                 
                 # Create user-file association if user is logged in
-                if 'user_id' in session:
-                    user_file = UserFile(
-                        user_id=session['user_id'],
-                        file_id=new_file.id
-                    )
-                    db.session.add(user_file)
-                    
-                    # Update user storage usage
-                    user = User.query.get(session['user_id'])
-                    if user:
-                        user.update_storage(new_file.file_size)
+                if user:
+                    db.session.add(UserFile(user=user, file=new_file))
+                    total_size += new_file.file_size
                 
                 results.append({
                     'filename': original_filename,
@@ -215,6 +213,10 @@ def bulk_upload():
                     'slug': slug
                 })
         
+        # Update user storage usage once for the whole batch
+        if user and total_size:
+            user.storage_used = max(0, user.storage_used + total_size)
+        
         db.session.commit()
         
         return jsonify({
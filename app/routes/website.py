@@ -5,24 +5,27 @@ Handles website creation, management, and publishing
 import os
 import zipfile
 import time
-import secrets
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_file, abort, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, abort, current_app, g
 from werkzeug.utils import secure_filename
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 from app import db
-from app.models import User, Website, WebsiteFile, File, UserFile
+from app.models import Website, WebsiteFile, File, UserFile
 from app.routes.auth import login_required
-from app.utils.file_organization import get_organized_file_path, ensure_uploads_structure
+from app.utils.file_organization import get_organized_file_path, get_stored_location, ensure_uploads_structure, save_file_stream, resolve_stored_file, remove_file_async
 from datetime import datetime
 
 website_bp = Blueprint('website', __name__)
 
+# Filenames treated as a site's entry page: index pages first, then other common homepages
+_INDEX_FILENAMES = frozenset(('index.html', 'index.htm'))
+_HOMEPAGE_FILENAMES = frozenset(('default.html', 'default.htm', 'home.html', 'home.htm'))
+
 @website_bp.route('/create', methods=['GET', 'POST'])
 @login_required
 def create_website():
     """Create a new website"""
-    user = User.query.get(session['user_id'])
-    if not user:
-        return redirect(url_for('auth.login'))
+    user = g.user
     
     if request.method == 'POST':
         name = request.form.get('name')
@@ -62,7 +65,7 @@ def create_website():
 @login_required
 def manage_website(website_id):
     """Manage website files and settings"""
-    user = User.query.get(session['user_id'])
+    user = g.user
     website = Website.query.get_or_404(website_id)
     
     # Check ownership
@@ -86,184 +89,248 @@ def manage_website(website_id):
 @login_required
 def upload_website_files(website_id):
     """Upload files to a website - supports folders and automatic index detection"""
-    user = User.query.get(session['user_id'])
-    website = Website.query.get_or_404(website_id)
+    user = g.user
+    # Load the site with its existing files (ids, path and index flag only) in one extra round-trip
+    website = Website.query.options(
+        selectinload(Website.website_files).load_only(WebsiteFile.id, WebsiteFile.file_id, WebsiteFile.file_path, WebsiteFile.is_index)
+    ).filter_by(id=website_id).first_or_404()
     
     # Check ownership
     if website.user_id != user.id and not user.is_admin:
         abort(403)
     
+    # Check user quota for free plan (e.g., 100MB total, 50 files max)
+    MAX_STORAGE_FREE = 100 * 1024 * 1024  # 100MB for free users
+    MAX_FILES_FREE = 50  # 50 files max for free users
+    MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB per file
+    
+    # Check if user is on free plan (you can add a premium flag to User model)
+    is_free_plan = not getattr(user, 'is_premium', False)
+    
+    # Reject an obviously over-quota request from its Content-Length, before the body is parsed.
+    # The length includes multipart boundaries and part headers, so allow for those; the exact
+    # limit is enforced while streaming and by the reservation below
+    MULTIPART_OVERHEAD = MAX_FILES_FREE * 1024
+    if is_free_plan and user.storage_used + (request.content_length or 0) - MULTIPART_OVERHEAD > MAX_STORAGE_FREE:
+        remaining = MAX_STORAGE_FREE - user.storage_used
+        flash(f'Free plan storage limit: {(remaining / 1024 / 1024):.1f}MB remaining. Upgrade to Pro for more storage!', 'warning')
+        return redirect(url_for('website.manage_website', website_id=website.id))
+    
     files = request.files.getlist('files[]')
     
     if not files:
         flash('No files selected.', 'warning')
         return redirect(url_for('website.manage_website', website_id=website.id))
     
-    # Check user quota for free plan (e.g., 100MB total, 50 files max)
-    MAX_STORAGE_FREE = 100 * 1024 * 1024  # 100MB for free users
-    MAX_FILES_FREE = 50  # 50 files max for free users
-    
     # Get current usage
-    current_file_count = website.website_files.count()
+    current_file_count = len(website.website_files)
     
-    # Check if user is on free plan (you can add a premium flag to User model)
-    is_free_plan = not getattr(user, 'is_premium', False)
-    
-    if is_free_plan:
-        if current_file_count + len(files) > MAX_FILES_FREE:
-            flash(f'Free plan limit: Maximum {MAX_FILES_FREE} files per website. Upgrade to Pro for unlimited files!', 'warning')
-            return redirect(url_for('website.manage_website', website_id=website.id))
-        
-        total_size = sum(f.content_length for f in files if f.content_length)
-        if user.storage_used + total_size > MAX_STORAGE_FREE:
-            remaining = MAX_STORAGE_FREE - user.storage_used
-            flash(f'Free plan storage limit: {(remaining / 1024 / 1024):.1f}MB remaining. Upgrade to Pro for more storage!', 'warning')
-            return redirect(url_for('website.manage_website', website_id=website.id))
+    if is_free_plan and current_file_count + len(files) > MAX_FILES_FREE:
+        flash(f'Free plan limit: Maximum {MAX_FILES_FREE} files per website. Upgrade to Pro for unlimited files!', 'warning')
+        return redirect(url_for('website.manage_website', website_id=website.id))
     
     uploaded_count = 0
     skipped_count = 0
     index_found = False
     
+    # Current index file, looked up once and kept up to date as files are marked below
+    existing_index = next((wf for wf in website.website_files if wf.is_index), None)
+    
+    # Existing entries by path (case-insensitive, like the unique index); re-uploads replace them
+    files_by_path = {wf.file_path.lower(): wf for wf in website.website_files if wf.file_path}
+    batch_paths = set()
+    replaced_file_ids = []
+    saved_paths = []
+    saved_size = 0
+    
     # Ensure uploads structure exists
     ensure_uploads_structure()
     
     # Get user identifier for folder organization
     user_identifier = user.username if user.username else f"user_{user.id}"
     
-    # Determine common top-level folder (when uploading a directory)
-    # We'll strip this folder from stored paths so that references like css/style.css resolve
-    root_prefix = None
-    
-    # First pass to detect a consistent root prefix if present
-    for f in files:
-        if f and f.filename:
-            norm = f.filename.replace('\\', '/')
-            parts = [p for p in norm.split('/') if p]
-            if len(parts) > 1:
-                root_prefix = parts[0] if root_prefix is None else root_prefix
-                break
+    # Stored filenames share the upload's timestamp; the random part keeps them unique
+    timestamp = time.strftime('%Y%m%d_%H%M%S', time.gmtime())
     
+    # Split every provided path once (browsers may include the folder name in filename)
+    uploads = []
     for file in files:
         if file and file.filename:
-            # Normalize provided path (browsers may include the folder name in filename)
             original_path = file.filename.replace('\\', '/')
-            parts = [p for p in original_path.split('/') if p]
-            
-            # Split into (folders..., base_filename)
-            if len(parts) > 1:
-                # Optionally strip common top-level folder
-                if root_prefix and parts[0] == root_prefix:
-                    parts = parts[1:]
-            
-            if parts:
-                raw_base = parts[-1]
-                raw_folders = parts[:-1]
+            uploads.append((file, original_path, [p for p in original_path.split('/') if p]))
+    
+    # Determine common top-level folder (when uploading a directory)
+    # We'll strip this folder from stored paths so that references like css/style.css resolve
+    root_prefix = next((parts[0] for _, _, parts in uploads if len(parts) > 1), None)
+    
+    for file, original_path, parts in uploads:
+        # Split into (folders..., base_filename)
+        if len(parts) > 1:
+            # Optionally strip common top-level folder
+            if root_prefix and parts[0] == root_prefix:
+                parts = parts[1:]
+        
+        if parts:
+            raw_base = parts[-1]
+            raw_folders = parts[:-1]
+        else:
+            raw_base = original_path
+            raw_folders = []
+        
+        # Sanitize each segment to avoid unsafe chars (segments that sanitize to nothing are dropped)
+        sanitized_folders = [seg for seg in map(secure_filename, raw_folders) if seg]
+        base_filename = secure_filename(raw_base)
+        
+        if not base_filename:
+            skipped_count += 1
+            continue
+        
+        # Reconstruct normalized relative path (preserved folder structure)
+        folder_path = '/'.join(sanitized_folders)
+        full_path = f"{folder_path}/{base_filename}" if folder_path else base_filename
+        
+        # A path given twice in one upload is only stored once
+        if full_path.lower() in batch_paths:
+            skipped_count += 1
+            continue
+        
+        # Generate unique stored filename (physical storage name)
+        random_str = os.urandom(8).hex()
+        ext = ''
+        if '.' in base_filename:
+            ext = '.' + base_filename.rsplit('.', 1)[1].lower()
+        stored_filename = f"{timestamp}_{random_str}{ext}"
+        
+        # Files over 50MB (reasonable limit per file), or past the free-plan quota, are cut off mid-upload
+        max_size = MAX_FILE_SIZE
+        if is_free_plan:
+            max_size = min(max_size, max(0, MAX_STORAGE_FREE - user.storage_used - saved_size))
+        
+        # Save file to organized folder structure (websitefiles)
+        file_path = get_organized_file_path('websitefiles', user_identifier, stored_filename)
+        # Stream to disk, counting bytes as they are written
+        file_size = save_file_stream(file, file_path, max_size=max_size)
+        
+        if file_size is None:
+            if max_size < MAX_FILE_SIZE:
+                flash(f'File {base_filename} exceeds your free plan storage limit. Upgrade to Pro for more storage!', 'warning')
             else:
-                raw_base = original_path
-                raw_folders = []
-            
-            # Sanitize each segment to avoid unsafe chars
-            sanitized_folders = [secure_filename(seg) for seg in raw_folders if seg]
-            base_filename = secure_filename(raw_base)
-            
-            if not base_filename:
-                skipped_count += 1
-                continue
-            
-            # Reconstruct normalized relative path (preserved folder structure)
-            folder_path = '/'.join(sanitized_folders)
-            full_path = f"{folder_path}/{base_filename}" if folder_path else base_filename
-            
-            # Generate unique stored filename (physical storage name)
-            timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-            random_str = secrets.token_hex(8)
-            ext = ''
-            if '.' in base_filename:
-                ext = '.' + base_filename.rsplit('.', 1)[1].lower()
-            stored_filename = f"{timestamp}_{random_str}{ext}"
-            
-            # Save file to organized folder structure (websitefiles)
-            file_path = get_organized_file_path('websitefiles', user_identifier, stored_filename)
-            file.save(file_path)
-            
-            # Get file size
-            file_size = os.path.getsize(file_path)
-            
-            # Skip files over 50MB (reasonable limit per file)
-            if file_size > 50 * 1024 * 1024:
-                os.remove(file_path)
                 flash(f'File {base_filename} is too large (max 50MB per file)', 'warning')
-                skipped_count += 1
-                continue
-            
-            # Create file record
-            new_file = File(
-                original_filename=base_filename,  # Store just the filename
-                stored_filename=stored_filename,
-                file_size=file_size,
-                mime_type=file.content_type or 'application/octet-stream',
-                upload_ip=request.remote_addr
-            )
-            db.session.add(new_file)
-            db.session.flush()
-            
-            # Create user file association
-            user_file = UserFile(
-                user_id=user.id,
-                file_id=new_file.id
-            )
-            db.session.add(user_file)
-            
-            # Automatic index.html detection - check various locations
-            is_index_file = False
-            filename_lower = base_filename.lower()
-            
-            # Check if it's index.html - PRIMARY CHECK
-            if filename_lower in ['index.html', 'index.htm']:
-                # If there's no existing index file, make this one the index
-                existing_index = website.website_files.filter_by(is_index=True).first()
+            skipped_count += 1
+            continue
+        
+        # Storage is reserved for the whole batch just before the commit, so no write
+        # transaction (and database lock) is held while files are streaming
+        saved_paths.append(file_path)
+        saved_size += file_size
+        
+        # Create file record
+        new_file = File(
+            original_filename=base_filename,  # Store just the filename
+            stored_filename=stored_filename,
+            stored_location=get_stored_location('websitefiles', user_identifier),
+            file_size=file_size,
+            mime_type=file.content_type or 'application/octet-stream',
+            file_extension=File.extension_for(base_filename, file.content_type),
+            upload_ip=request.remote_addr
+        )
+        # Create user file association (linked by relationship; ids are assigned in one flush at commit)
+        user_file = UserFile(
+            user=user,
+            file=new_file
+        )
+        
+        # Automatic index.html detection - check various locations
+        is_index_file = False
+        filename_lower = base_filename.lower()
+        
+        # Check if it's index.html - PRIMARY CHECK
+        if filename_lower in _INDEX_FILENAMES:
+            # If there's no existing index file, make this one the index
+            if not existing_index:
+                is_index_file = True
+                index_found = True
+            # If at root level (no folder), always prefer this as index
+            elif not folder_path:
+                # Unmark the old index
+                if existing_index:
+                    existing_index.is_index = False
+                is_index_file = True
+                index_found = True
+        
+        # Also accept other common homepage files if no index.html exists
+        if not is_index_file and not index_found:
+            if filename_lower in _HOMEPAGE_FILENAMES:
                 if not existing_index:
                     is_index_file = True
                     index_found = True
-                # If at root level (no folder), always prefer this as index
-                elif not folder_path:
-                    # Unmark the old index
-                    if existing_index:
-                        existing_index.is_index = False
-                    is_index_file = True
-                    index_found = True
-            
-            # Also accept other common homepage files if no index.html exists
-            if not is_index_file and not index_found:
-                other_patterns = ['default.html', 'default.htm', 'home.html', 'home.htm']
-                if filename_lower in other_patterns:
-                    existing_index = website.website_files.filter_by(is_index=True).first()
-                    if not existing_index:
-                        is_index_file = True
-                        index_found = True
-            
-            # Create website file association with normalized folder path
+        
+        # Create website file association with normalized folder path; a file already at
+        # this path is pointed at the new upload (the old file is removed below)
+        website_file = files_by_path.get(full_path.lower())
+        if website_file is not None:
+            replaced_file_ids.append(website_file.file_id)
+            website_file.file = new_file
+            website_file.file_path = full_path
+            website_file.is_index = website_file.is_index or is_index_file
+        else:
             website_file = WebsiteFile(
-                website_id=website.id,
-                file_id=new_file.id,
+                website=website,
+                file=new_file,
                 file_path=full_path,  # Store full path relative to root
                 is_index=is_index_file
             )
-            db.session.add(website_file)
-            
-            # Update user storage
-            user.update_storage(file_size)
-            
-            uploaded_count += 1
+        batch_paths.add(full_path.lower())
+        db.session.add_all([new_file, user_file, website_file])
+        if is_index_file:
+            existing_index = website_file
+        
+        uploaded_count += 1
+    
+    # One transaction for every record in the upload
+    replaced = []
+    try:
+        # Replaced files are deleted with their user links, and their size is given back
+        if replaced_file_ids:
+            replaced = db.session.execute(
+                db.select(File.file_size, File.stored_filename, File.stored_location).where(File.id.in_(replaced_file_ids))
+            ).all()
+            db.session.execute(db.delete(UserFile).where(UserFile.file_id.in_(replaced_file_ids)))
+            db.session.execute(db.delete(File).where(File.id.in_(replaced_file_ids)))
+        
+        # Count the batch against the user's storage; the quota check and increment are one atomic UPDATE
+        size_change = saved_size - sum(row.file_size or 0 for row in replaced)
+        limit = MAX_STORAGE_FREE if is_free_plan and size_change > 0 else None
+        reserved = not size_change or user.reserve_storage(size_change, limit)
+        if reserved:
+            db.session.commit()
+    except IntegrityError:
+        # A concurrent upload added one of these paths first (unique per site)
+        db.session.rollback()
+        for file_path in saved_paths:
+            os.remove(file_path)
+        flash('The website was changed by another upload at the same time. Please try again.', 'warning')
+        return redirect(url_for('website.manage_website', website_id=website.id))
     
-    db.session.commit()
+    if not reserved:
+        db.session.rollback()
+        for file_path in saved_paths:
+            os.remove(file_path)
+        flash('Free plan storage limit reached. Upgrade to Pro for more storage!', 'warning')
+        return redirect(url_for('website.manage_website', website_id=website.id))
+    
+    # The database is authoritative; remove the replaced files in the background
+    for row in replaced:
+        old_path = resolve_stored_file(row.stored_filename, row.stored_location)
+        if old_path:
+            remove_file_async(old_path)
     
     # Provide feedback
     if uploaded_count > 0:
         flash(f'✅ {uploaded_count} file(s) uploaded successfully!', 'success')
         if index_found:
             flash('🎉 Index file detected! Your website is ready to publish.', 'success')
-        elif not website.website_files.filter_by(is_index=True).first():
+        elif not existing_index:
             flash('💡 Tip: Upload an index.html file to publish your website.', 'info')
     
     if skipped_count > 0:
@@ -276,20 +343,25 @@ def upload_website_files(website_id):
 def publish_website(website_id):
     """Publish or unpublish a website"""
     
-    user = User.query.get(session['user_id'])
+    user = g.user
     website = Website.query.get_or_404(website_id)
     
     # Check ownership
     if website.user_id != user.id and not user.is_admin:
         abort(403)
     
+    # Check for any files and for an index file in one query
+    has_files, has_index = db.session.execute(db.select(
+        db.select(WebsiteFile.id).where(WebsiteFile.website_id == website.id).exists(),
+        db.select(WebsiteFile.id).where(WebsiteFile.website_id == website.id, WebsiteFile.is_index.is_(True)).exists()
+    )).one()
+    
     # Check if website has files
-    if website.website_files.count() == 0:
+    if not has_files:
         flash('Please upload files before publishing.', 'warning')
         return redirect(url_for('website.manage_website', website_id=website.id))
     
     # Check if website has index file
-    has_index = website.website_files.filter_by(is_index=True).first() is not None
     if not has_index:
         flash('Please upload an index.html file to publish your website.', 'warning')
         return redirect(url_for('website.manage_website', website_id=website.id))
@@ -312,7 +384,7 @@ def publish_website(website_id):
 @login_required
 def delete_website(website_id):
     """Delete a website and all associated files"""
-    user = User.query.get(session['user_id'])
+    user = g.user
     website = Website.query.get_or_404(website_id)
     
     # Check ownership
@@ -321,6 +393,7 @@ def delete_website(website_id):
     
     # Delete website (cascade will delete website_files)
     db.session.delete(website)
+    website.owner.storage_dirty = True
     db.session.commit()
     
     flash('Website deleted successfully.', 'info')
@@ -330,9 +403,7 @@ def delete_website(website_id):
 @login_required
 def my_websites():
     """List all user's websites"""
-    user = User.query.get(session['user_id'])
-    if not user:
-        return redirect(url_for('auth.login'))
+    user = g.user
     
     websites = Website.query.filter_by(user_id=user.id).order_by(Website.updated_date.desc()).all()
     
@@ -342,56 +413,38 @@ def my_websites():
 @login_required
 def fix_index_detection(website_id):
     """Re-scan website files and fix index.html detection"""
-    user = User.query.get(session['user_id'])
+    user = g.user
     website = Website.query.get_or_404(website_id)
     
     # Check ownership
     if website.user_id != user.id and not user.is_admin:
         abort(403)
     
-    # First, unmark all existing index files for this website
-    WebsiteFile.query.filter_by(website_id=website.id).update({'is_index': False})
-    
-    # Then, scan all files to find the best candidate for index
-    index_found = False
-    root_index = None
-    other_indexes = []
-
-    # Query all files at once to minimize DB calls
-    all_website_files = db.session.query(WebsiteFile, File).join(File, WebsiteFile.file_id == File.id).filter(WebsiteFile.website_id == website.id).all()
-
-    for wf, file in all_website_files:
-        filename_lower = file.original_filename.lower()
-        
-        if filename_lower in ['index.html', 'index.htm']:
-            file_path = wf.file_path or ''
-            is_root = not '/' in file_path or file_path == file.original_filename
-
-            if is_root:
-                if not root_index: # Find the first root index
-                    root_index = wf
-            else:
-                other_indexes.append(wf)
-
-    # Prioritize root index, then other indexes
-    if root_index:
-        root_index.is_index = True
-        index_found = True
-    elif other_indexes:
-        other_indexes[0].is_index = True # Mark the first one found
-        index_found = True
-
-    # If still no index.html, check for other common files like home.html at root
-    if not index_found:
-        for wf, file in all_website_files:
-            filename_lower = file.original_filename.lower()
-            if filename_lower in ['default.html', 'default.htm', 'home.html', 'home.htm']:
-                file_path = wf.file_path or ''
-                is_root = not '/' in file_path or file_path == file.original_filename
-                if is_root:
-                    wf.is_index = True
-                    index_found = True
-                    break
+    # Pick the best candidate in SQL: any index.html/htm (root first), else a root-level
+    # default/home page; ties go to the earliest upload
+    filename_lower = db.func.lower(File.original_filename)
+    is_index_name = filename_lower.in_(sorted(_INDEX_FILENAMES))
+    is_root = db.or_(WebsiteFile.file_path.is_(None), ~WebsiteFile.file_path.contains('/'))
+    chosen_id = db.session.execute(
+        db.select(WebsiteFile.id).join(File, WebsiteFile.file_id == File.id).where(
+            WebsiteFile.website_id == website.id,
+            db.or_(
+                is_index_name,
+                db.and_(filename_lower.in_(sorted(_HOMEPAGE_FILENAMES)), is_root)
+            )
+        ).order_by(
+            db.case((is_index_name, 0), else_=1),
+            db.case((is_root, 0), else_=1),
+            WebsiteFile.id
+        ).limit(1)
+    ).scalar()
+    index_found = chosen_id is not None
+    
+    # Mark the chosen file and unmark every other one in a single statement
+    WebsiteFile.query.filter_by(website_id=website.id).update(
+        {'is_index': WebsiteFile.id == chosen_id if index_found else False},
+        synchronize_session=False
+    )
     
     db.session.commit()
     
@@ -406,37 +459,32 @@ def fix_index_detection(website_id):
 @login_required
 def cleanup_duplicate_files(website_id):
     """Remove duplicate files from website"""
-    user = User.query.get(session['user_id'])
+    user = g.user
     website = Website.query.get_or_404(website_id)
     
     # Check ownership
     if website.user_id != user.id and not user.is_admin:
         abort(403)
     
-    # Get all website files
-    website_files = list(website.website_files)
-    seen_files = {}
-    duplicates_removed = 0
-    
-    # Group files by filename and path
-    for wf in website_files:
-        file = wf.file
-        key = (file.original_filename.lower(), wf.file_path or '')
-        
-        if key in seen_files:
-            # This is a duplicate - keep the newer one (higher ID)
-            existing_wf = seen_files[key]
-            if wf.id > existing_wf.id:
-                # Remove the older one
-                db.session.delete(existing_wf)
-                seen_files[key] = wf
-            else:
-                # Remove this one
-                db.session.delete(wf)
-            duplicates_removed += 1
-        else:
-            seen_files[key] = wf
+    # Keep the newest row (highest id) for each filename and path; delete the rest in one statement
+    newest_ids = db.select(db.func.max(WebsiteFile.id)).join(
+        File, WebsiteFile.file_id == File.id
+    ).where(
+        WebsiteFile.website_id == website.id
+    ).group_by(
+        db.func.lower(File.original_filename), db.func.coalesce(WebsiteFile.file_path, '')
+    )
+    result = db.session.execute(
+        db.delete(WebsiteFile).where(
+            WebsiteFile.website_id == website.id,
+            WebsiteFile.id.not_in(newest_ids)
+        ),
+        execution_options={'synchronize_session': False}
+    )
+    duplicates_removed = result.rowcount
     
+    if duplicates_removed > 0:
+        website.owner.storage_dirty = True
     db.session.commit()
     
     if duplicates_removed > 0:
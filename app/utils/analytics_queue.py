@@ -0,0 +1,165 @@
+"""
+Analytics Queue
+Buffers link hits and website views in memory and writes them to the database in batches
+"""
+import os
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime
+from flask import current_app
+from app import db
+
+_events = queue.SimpleQueue()
+_worker_lock = threading.Lock()
+_worker = None
+_worker_pid = None
+_app = None
+
+def record_hit(link_id, ip_address=None, user_agent=None, referrer=None):
+    """Queue a link view together with its analytics record"""
+    _enqueue({
+        'link_id': link_id,
+        'access_date': datetime.utcnow(),
+        'ip_address': ip_address,
+        'user_agent': user_agent,
+        'referrer': referrer,
+        'track': True
+    })
+
+def record_view(link_id):
+    """Queue a link view without an analytics record"""
+    _enqueue({
+        'link_id': link_id,
+        'access_date': datetime.utcnow(),
+        'track': False
+    })
+
+def record_site_view(website_id):
+    """Queue a published-website view"""
+    _enqueue({
+        'website_id': website_id,
+        'track': False
+    })
+
+def _enqueue(event):
+    """Add an event to the queue, flushing inline when batching is disabled"""
+    _events.put(event)
+
+    if current_app.config.get('ANALYTICS_FLUSH_INTERVAL', 0) <= 0:
+        flush()
+    else:
+        _ensure_worker(current_app._get_current_object())
+
+def flush(max_events=5000):
+    """Write pending events to the database (requires an app context)"""
+    events = []
+    while len(events) < max_events:
+        try:
+            events.append(_events.get_nowait())
+        except queue.Empty:
+            break
+
+    if not events:
+        return 0
+
+    from app.models import Link, Analytics, Website
+
+    rows = []
+    view_counts = {}
+    last_accessed = {}
+    site_views = {}
+    for event in events:
+        if 'website_id' in event:
+            site_views[event['website_id']] = site_views.get(event['website_id'], 0) + 1
+            continue
+
+        link_id = event['link_id']
+        view_counts[link_id] = view_counts.get(link_id, 0) + 1
+        last_accessed[link_id] = max(last_accessed.get(link_id, event['access_date']), event['access_date'])
+        if event['track']:
+            rows.append({
+                'link_id': link_id,
+                'access_date': event['access_date'],
+                'ip_address': event['ip_address'],
+                'user_agent': event['user_agent'],
+                'referrer': event['referrer']
+            })
+
+    try:
+        if rows:
+            db.session.bulk_insert_mappings(Analytics, rows)
+
+        # One executemany UPDATE covering every link that received hits
+        if view_counts:
+            links = Link.__table__
+            db.session.execute(
+                db.update(links).where(links.c.id == db.bindparam('link_id')).values(
+                    view_count=links.c.view_count + db.bindparam('delta'),
+                    last_accessed=db.bindparam('accessed')
+                ),
+                [
+                    {'link_id': link_id, 'delta': delta, 'accessed': last_accessed[link_id]}
+                    for link_id, delta in view_counts.items()
+                ]
+            )
+
+        # Same for website views, so viewers never wait on the websites row lock;
+        # updated_date is pinned so views do not count as edits (it keys the site page cache)
+        if site_views:
+            websites = Website.__table__
+            db.session.execute(
+                db.update(websites).where(websites.c.id == db.bindparam('website_id')).values(
+                    view_count=websites.c.view_count + db.bindparam('delta'),
+                    updated_date=websites.c.updated_date
+                ),
+                [
+                    {'website_id': website_id, 'delta': delta}
+                    for website_id, delta in site_views.items()
+                ]
+            )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Analytics flush error: {str(e)}")
+        return 0
+
+    return len(events)
+
+def _ensure_worker(app):
+    """Start the background flush thread once per process (after fork too)"""
+    global _worker, _worker_pid, _app
+
+    if _worker is not None and _worker_pid == os.getpid() and _worker.is_alive():
+        return
+
+    with _worker_lock:
+        if _worker is not None and _worker_pid == os.getpid() and _worker.is_alive():
+            return
+
+        _app = app
+        _worker_pid = os.getpid()
+        _worker = threading.Thread(
+            target=_run,
+            args=(app, app.config['ANALYTICS_FLUSH_INTERVAL']),
+            name='analytics-flush',
+            daemon=True
+        )
+        _worker.start()
+
+def _run(app, interval):
+    """Background loop draining the queue every `interval` seconds"""
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            while flush():
+                pass
+
+@atexit.register
+def _flush_at_exit():
+    """Write whatever is still queued when the process shuts down"""
+    if _app is not None:
+        with _app.app_context():
+            while flush():
+                pass
@@ -0,0 +1,76 @@
+"""
+Concurrent Request Limiting
+Caps in-flight requests per client with a Redis sorted set updated atomically by a Lua script
+"""
+import time
+import uuid
+from functools import wraps
+from flask import current_app, request, jsonify
+from flask_limiter.util import get_remote_address
+
+# Drop stale entries, check the in-flight count and register this request in one round-trip
+_ACQUIRE_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local timeout = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - timeout)
+if redis.call('ZCARD', key) >= limit then
+    return 0
+end
+redis.call('ZADD', key, now, ARGV[4])
+redis.call('EXPIRE', key, math.ceil(timeout))
+return 1
+"""
+
+def _get_backend():
+    """Get the Redis client and acquire script, or None when Redis is not configured"""
+    storage_uri = current_app.config.get('RATELIMIT_STORAGE_URI') or ''
+    if not storage_uri.startswith(('redis://', 'rediss://')):
+        return None
+
+    backend = current_app.extensions.get('concurrency_limit')
+    if backend is None:
+        import redis
+        client = redis.Redis.from_url(storage_uri)
+        backend = {
+            'redis': client,
+            'acquire': client.register_script(_ACQUIRE_SCRIPT)
+        }
+        current_app.extensions['concurrency_limit'] = backend
+    return backend
+
+def concurrent_limit(max_requests, timeout=120):
+    """Decorator limiting how many requests a client may have in flight at once
+
+    Entries older than `timeout` seconds are treated as abandoned. Without a
+    Redis rate-limit storage this is a no-op.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            backend = _get_backend()
+            if backend is None:
+                return f(*args, **kwargs)
+
+            key = f"concurrent:{request.endpoint}:{get_remote_address()}"
+            request_id = uuid.uuid4().hex
+            try:
+                acquired = backend['acquire'](keys=[key], args=[time.time(), timeout, max_requests, request_id])
+            except Exception as e:
+                # Fail open: a Redis outage must not take uploads down
+                current_app.logger.error(f"Concurrency limiter error: {str(e)}")
+                return f(*args, **kwargs)
+
+            if not acquired:
+                return jsonify({'error': 'Too many concurrent requests'}), 429
+
+            try:
+                return f(*args, **kwargs)
+            finally:
+                try:
+                    backend['redis'].zrem(key, request_id)
+                except Exception as e:
+                    current_app.logger.error(f"Concurrency limiter error: {str(e)}")
+        return decorated_function
+    return decorator
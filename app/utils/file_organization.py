@@ -3,27 +3,45 @@ File Organization Utilities
 Handles organized file storage for shared files and website files
 """
 import os
-from flask import current_app
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from flask import current_app, g, request, send_file
+from werkzeug.utils import send_file as _werkzeug_send_file
+
+# Background unlinks, so slow (e.g. network) filesystems do not hold up requests
+_unlink_executor = None
+_unlink_executor_lock = threading.Lock()
+
+# Where each legacy stored file (no recorded location) was last found; stored filenames never move
+_PATH_CACHE_SIZE = 4096
+_path_cache = OrderedDict()
+_path_cache_lock = threading.Lock()
 
 def get_user_identifier(session=None, default_user="anonymous"):
     """Get user identifier for folder naming"""
     if session and 'username' in session:
         return session['username']
     elif session and 'user_id' in session:
-        # If we have user_id but no username, we could fetch from database
-        from app.models import User
-        user = User.query.get(session['user_id'])
+        # If we have user_id but no username, use the user loaded for this request
+        user = g.get('user')
         if user:
             return user.username
     return default_user
 
+@functools.lru_cache(maxsize=1024)
+def _ensure_dir(path):
+    """Create a directory (and parents) once per process; later calls cost no syscalls"""
+    os.makedirs(path, exist_ok=True)
+
 def create_user_folder(folder_type, user_identifier):
     """Create user-specific folder if it doesn't exist"""
     base_path = current_app.config['UPLOAD_FOLDER']
     user_folder = os.path.join(base_path, folder_type, user_identifier)
     
-    if not os.path.exists(user_folder):
-        os.makedirs(user_folder, exist_ok=True)
+    _ensure_dir(user_folder)
     
     return user_folder
 
@@ -32,6 +50,37 @@ def get_organized_file_path(folder_type, user_identifier, filename):
     user_folder = create_user_folder(folder_type, user_identifier)
     return os.path.join(user_folder, filename)
 
+def save_file_stream(file, file_path, chunk_size=1024 * 1024, dir_fd=None, max_size=None):
+    """Stream an uploaded file to disk in large chunks, returning the bytes written
+    
+    The file must not exist yet (O_EXCL). With dir_fd, file_path is resolved
+    relative to that open directory instead of from the filesystem root.
+    With max_size, the copy stops as soon as the file grows past it: the partial
+    file is removed and None is returned.
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    fd = os.open(file_path, flags, 0o644, dir_fd=dir_fd)
+    
+    size = 0
+    with os.fdopen(fd, 'wb', buffering=0) as out:
+        while True:
+            chunk = file.stream.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                break
+            out.write(chunk)
+    
+    if max_size is not None and size > max_size:
+        os.unlink(file_path, dir_fd=dir_fd)
+        return None
+    return size
+
+def get_stored_location(folder_type, user_identifier):
+    """Folder of an organized upload relative to UPLOAD_FOLDER, as recorded on File.stored_location"""
+    return f"{folder_type}/{user_identifier}"
+
 def get_relative_organized_path(folder_type, user_identifier, filename):
     """Get relative path for database storage"""
     return os.path.join(folder_type, user_identifier, filename)
@@ -43,12 +92,10 @@ def ensure_uploads_structure():
     # Create main folders
     folders = ['sharedfiles', 'websitefiles']
     for folder in folders:
-        folder_path = os.path.join(base_path, folder)
-        if not os.path.exists(folder_path):
-            os.makedirs(folder_path, exist_ok=True)
+        _ensure_dir(os.path.join(base_path, folder))
 
 def find_file_in_organized_structure(filename):
-    """Find a file in the organized structure (for legacy support)"""
+    """Find a file in the organized structure (for legacy rows without a recorded location)"""
     base_path = current_app.config['UPLOAD_FOLDER']
     
     # Check flat structure first (for old files)
@@ -56,15 +103,85 @@ def find_file_in_organized_structure(filename):
     if os.path.exists(flat_path):
         return flat_path
     
-    # Check organized structure
+    # Check organized structure (scandir entries carry their type, so no extra stat per folder)
     for folder_type in ['sharedfiles', 'websitefiles']:
         folder_path = os.path.join(base_path, folder_type)
-        if os.path.exists(folder_path):
-            for user_folder in os.listdir(folder_path):
-                user_path = os.path.join(folder_path, user_folder)
-                if os.path.isdir(user_path):
-                    file_path = os.path.join(user_path, filename)
+        try:
+            entries = os.scandir(folder_path)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir():
+                    file_path = os.path.join(entry.path, filename)
                     if os.path.exists(file_path):
                         return file_path
     
-    return None
\ No newline at end of file
+    return None
+
+def resolve_stored_file(filename, location=None):
+    """Find a stored file on disk from its recorded location, walking the folders only for legacy rows"""
+    # Files saved with a location are found with a single stat
+    if location is not None:
+        path = os.path.join(current_app.config['UPLOAD_FOLDER'], *location.split('/'), filename)
+        return path if os.path.exists(path) else None
+    
+    with _path_cache_lock:
+        path = _path_cache.get(filename)
+    
+    # A cached location costs one stat; only walk the folders if it is gone
+    if path is not None and os.path.exists(path):
+        return path
+    
+    path = find_file_in_organized_structure(filename)
+    with _path_cache_lock:
+        if path is None:
+            _path_cache.pop(filename, None)
+        else:
+            _path_cache[filename] = path
+            _path_cache.move_to_end(filename)
+            while len(_path_cache) > _PATH_CACHE_SIZE:
+                _path_cache.popitem(last=False)
+    return path
+
+def remove_file_async(file_path):
+    """Unlink a file on a background thread, logging rather than raising failures"""
+    global _unlink_executor
+    
+    if _unlink_executor is None:
+        with _unlink_executor_lock:
+            if _unlink_executor is None:
+                _unlink_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='unlink')
+    
+    logger = current_app.logger
+    
+    def _unlink():
+        try:
+            os.unlink(file_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error removing {file_path}: {str(e)}")
+    
+    _unlink_executor.submit(_unlink)
+
+def send_stored_file(file_path, **kwargs):
+    """send_file, handing the transfer to nginx via X-Accel-Redirect when ACCEL_REDIRECT_PREFIX is set"""
+    prefix = current_app.config.get('ACCEL_REDIRECT_PREFIX')
+    if not prefix:
+        return send_file(file_path, **kwargs)
+    
+    # Let Werkzeug build the headers (disposition, length, validators) without a body
+    response = _werkzeug_send_file(
+        file_path,
+        request.environ,
+        use_x_sendfile=True,
+        response_class=current_app.response_class,
+        **kwargs
+    )
+    # Conditional requests answered with 304 carry no X-Sendfile and need no redirect
+    sendfile_path = response.headers.pop('X-Sendfile', None)
+    if sendfile_path:
+        relative_path = os.path.relpath(sendfile_path, current_app.config['UPLOAD_FOLDER'])
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(relative_path.replace(os.sep, '/'))
+    return response
@@ -14,11 +14,15 @@ class Config:
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
     MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB max file size
     ALLOWED_EXTENSIONS = set()  # Empty set means all extensions allowed
+    # Internal nginx location aliased to UPLOAD_FOLDER; when set, downloads are sent via X-Accel-Redirect
+    ACCEL_REDIRECT_PREFIX = os.environ.get('ACCEL_REDIRECT_PREFIX')
     
     # Database
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'filelink.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Run db.create_all() on startup (production relies on init_db.py / migrations)
+    AUTO_CREATE_TABLES = os.environ.get('AUTO_CREATE_TABLES', '').lower() in ('1', 'true', 'yes')
     
     # Session Configuration
     PERMANENT_SESSION_LIFETIME = timedelta(days=7)
@@ -30,9 +34,13 @@ class Config:
     LINK_EXPIRY_DAYS = 0  # 0 means links never expire
     ENABLE_ANALYTICS = True
     ENABLE_PASSWORD_PROTECTION = True
+    ANALYTICS_FLUSH_INTERVAL = 2.0  # Seconds between batched analytics writes (0 writes inline)
+    LANDING_STATS_TTL = 60  # Seconds to cache landing-page counters (0 disables)
+    SHARE_PAGE_CACHE_TTL = 5  # Seconds to reuse a rendered public share page (0 disables)
     
-    # Rate Limiting
-    RATELIMIT_STORAGE_URL = "memory://"
+    # Rate Limiting (use Redis so limits are shared by all workers)
+    RATELIMIT_STORAGE_URI = os.environ.get('RATELIMIT_STORAGE_URI') or os.environ.get('REDIS_URL') or 'memory://'
+    RATELIMIT_STRATEGY = 'moving-window'
     
     # Application Settings
     APP_NAME = "FileLink Pro"
@@ -44,6 +52,7 @@ class DevelopmentConfig(Config):
     DEBUG = True
     TESTING = False
     ENV = 'development'
+    AUTO_CREATE_TABLES = True
 
 class ProductionConfig(Config):
     """Production environment configuration"""
@@ -56,6 +65,10 @@ class TestingConfig(Config):
     """Testing environment configuration"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    AUTO_CREATE_TABLES = True
+    ANALYTICS_FLUSH_INTERVAL = 0
+    LANDING_STATS_TTL = 0
+    SHARE_PAGE_CACHE_TTL = 0
 
 # Configuration dictionary
 config = {
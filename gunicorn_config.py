@@ -10,9 +10,11 @@ backlog = 2048
 
 # Worker processes
 workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
-worker_connections = 1000
-max_requests = 1000
+# Threaded workers, so one slow upload or download does not tie up a whole process
+worker_class = "gthread"
+threads = 8
+worker_connections = 2000
+max_requests = 2000
 max_requests_jitter = 50
 timeout = 30
 graceful_timeout = 30
@@ -31,6 +33,8 @@ access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)s "%(f)s" "%(a)s"
 proc_name = "filelink-gunicorn"
 
 # Server mechanics
+# Stored files are returned through wsgi.file_wrapper, which gunicorn sends with sendfile(2)
+sendfile = True
 daemon = False
 pidfile = None
 umask = 0
@@ -5,6 +5,7 @@ Creates all tables and optionally adds an admin user
 """
 import os
 import sys
+from flask_migrate import stamp
 from app import create_app, db
 from app.models import User
 
@@ -22,6 +23,9 @@ def init_database():
         print("Creating database tables...")
         db.create_all()
         
+        # The tables match the latest migration, so later `flask db upgrade` runs start from here
+        stamp(directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
+        
         # Create admin user
         print("Creating admin user...")
         admin = User(
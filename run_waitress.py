@@ -22,4 +22,14 @@ if __name__ == '__main__':
     print("Press Ctrl+C to quit")
     
     # Serve with Waitress (production-ready server for Windows)
-    serve(app, host=host, port=port, threads=4)
\ No newline at end of file
+    # Size the thread pool from the host; read request bodies in 64KB socket reads (default 8KB)
+    # so large uploads take fewer syscalls, and use poll() so many open uploads are not capped by select()
+    serve(
+        app,
+        host=host,
+        port=port,
+        threads=max(8, (os.cpu_count() or 1) * 2),
+        recv_bytes=65536,
+        asyncore_use_poll=True,
+        channel_timeout=120
+    )
\ No newline at end of file
@@ -0,0 +1,57 @@
+"""
+Test Helpers
+Shared application setup for the test suite
+"""
+import io
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import config
+from app import create_app, db
+
+
+class AppTestCase(unittest.TestCase):
+    """Runs each test against a fresh in-memory database and upload folder"""
+    
+    def setUp(self):
+        self.upload_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.upload_folder, ignore_errors=True)
+        
+        with mock.patch.object(config.TestingConfig, 'UPLOAD_FOLDER', self.upload_folder):
+            self.app = create_app('testing')
+        self.app.config['RATELIMIT_ENABLED'] = False
+        self.client = self.app.test_client()
+        
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self.addCleanup(self.ctx.pop)
+        self.addCleanup(db.session.remove)
+    
+    def register(self, email='user@example.com', password='secret1'):
+        """Register and log in a user through the auth form"""
+        response = self.client.post('/auth/register', data={
+            'email': email,
+            'password': password,
+            'confirm_password': password,
+            'full_name': 'Test User'
+        })
+        self.assertIn(response.status_code, (200, 302))
+        return response
+    
+    def create_website(self, name='Test Site'):
+        """Create a website for the logged-in user, returning it"""
+        from app.models import Website
+        
+        response = self.client.post('/website/create', data={'name': name, 'description': '', 'is_public': 'on'})
+        self.assertIn(response.status_code, (200, 302))
+        return Website.query.filter_by(name=name).one()
+    
+    def upload_website_files(self, website_id, files):
+        """Upload (path, bytes) pairs to a website"""
+        response = self.client.post(f'/website/{website_id}/upload', data={
+            'files[]': [(io.BytesIO(content), path) for path, content in files]
+        }, content_type='multipart/form-data')
+        self.assertIn(response.status_code, (200, 302))
+        return response
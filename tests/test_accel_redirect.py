@@ -0,0 +1,65 @@
+"""
+X-Accel-Redirect Tests
+Downloads handed to nginx must still answer conditional requests
+"""
+import io
+
+from tests.base import AppTestCase
+
+
+class AccelRedirectTestCase(AppTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        self.app.config['ACCEL_REDIRECT_PREFIX'] = '/protected-uploads/'
+    
+    def upload_shared_file(self, content=b'hello world', filename='a.txt'):
+        response = self.client.post('/api/upload', data={
+            'file': (io.BytesIO(content), filename)
+        }, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 201)
+        return response.get_json()['link']['slug']
+    
+    def test_download_is_redirected_to_nginx(self):
+        slug = self.upload_shared_file()
+        
+        response = self.client.get(f'/r/{slug}/download')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['X-Accel-Redirect'].startswith('/protected-uploads/'))
+        self.assertNotIn('X-Sendfile', response.headers)
+    
+    def test_revalidated_download_returns_304(self):
+        slug = self.upload_shared_file()
+        etag = self.client.get(f'/r/{slug}/download').headers['ETag']
+        
+        response = self.client.get(f'/r/{slug}/download', headers={'If-None-Match': etag})
+        
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('X-Accel-Redirect', response.headers)
+    
+    def test_revalidated_preview_returns_304(self):
+        slug = self.upload_shared_file()
+        last_modified = self.client.get(f'/r/{slug}/preview').headers['Last-Modified']
+        
+        response = self.client.get(f'/r/{slug}/preview', headers={'If-Modified-Since': last_modified})
+        
+        self.assertEqual(response.status_code, 304)
+    
+    def test_revalidated_site_asset_returns_304(self):
+        self.register()
+        website = self.create_website()
+        self.upload_website_files(website.id, [
+            ('site/index.html', b'<html><head></head><body>hi</body></html>'),
+            ('site/css/style.css', b'body{}')
+        ])
+        self.client.post(f'/website/{website.id}/publish')
+        
+        first = self.client.get(f'/site/{website.slug}/assets/css/style.css')
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('X-Accel-Redirect', first.headers)
+        
+        response = self.client.get(f'/site/{website.slug}/assets/css/style.css', headers={'If-None-Match': first.headers['ETag']})
+        
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('X-Accel-Redirect', response.headers)
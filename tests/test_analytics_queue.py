@@ -0,0 +1,24 @@
+"""
+Analytics Queue Tests
+Batched view counting must not look like an edit
+"""
+from app import db
+from app.models import Website
+from app.utils import analytics_queue
+from tests.base import AppTestCase
+
+
+class SiteViewFlushTestCase(AppTestCase):
+    
+    def test_site_views_keep_updated_date(self):
+        self.register()
+        website = self.create_website()
+        updated_date = website.updated_date
+        
+        analytics_queue.record_site_view(website.id)
+        analytics_queue.record_site_view(website.id)
+        db.session.expire_all()
+        
+        website = db.session.get(Website, website.id)
+        self.assertEqual(website.view_count, 2)
+        self.assertEqual(website.updated_date, updated_date)
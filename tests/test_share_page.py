@@ -0,0 +1,44 @@
+"""
+Share Page Tests
+Cached share pages must follow the link they render
+"""
+import io
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import Link
+from tests.base import AppTestCase
+
+
+class SharePageCacheTestCase(AppTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        self.app.config['SHARE_PAGE_CACHE_TTL'] = 60
+        response = self.client.post('/api/upload', data={
+            'file': (io.BytesIO(b'hello world'), 'a.bin')
+        }, content_type='multipart/form-data')
+        self.slug = response.get_json()['link']['slug']
+    
+    def update_link(self, **values):
+        db.session.execute(db.update(Link).where(Link.slug == self.slug).values(**values))
+        db.session.commit()
+    
+    def test_page_shows_current_view_count(self):
+        self.update_link(view_count=41)
+        self.assertIn(b'42 views', self.client.get(f'/r/{self.slug}').data)
+        self.assertIn(b'43 views', self.client.get(f'/r/{self.slug}').data)
+    
+    def test_edited_expiry_is_shown(self):
+        self.client.get(f'/r/{self.slug}')
+        self.update_link(expiry_date=datetime(2999, 1, 2))
+        
+        self.assertIn(b'January 02, 2999', self.client.get(f'/r/{self.slug}').data)
+    
+    def test_deactivated_or_expired_link_is_not_served_from_cache(self):
+        self.client.get(f'/r/{self.slug}')
+        self.update_link(expiry_date=datetime.utcnow() - timedelta(days=1))
+        self.assertEqual(self.client.get(f'/r/{self.slug}').status_code, 410)
+        
+        self.update_link(expiry_date=None, is_active=False)
+        self.assertEqual(self.client.get(f'/r/{self.slug}').status_code, 404)
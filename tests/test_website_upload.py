@@ -0,0 +1,78 @@
+"""
+Website Upload Tests
+Re-uploading a path must replace the stored file, not add to it
+"""
+import os
+
+from app import db
+from app.models import File, User, UserFile, WebsiteFile
+from tests.base import AppTestCase
+
+
+class WebsiteReuploadTestCase(AppTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        self.register()
+        self.website = self.create_website()
+        self.user = User.query.filter_by(email='user@example.com').one()
+    
+    def stored_files(self):
+        folder = os.path.join(self.upload_folder, 'websitefiles')
+        return [name for _, _, names in os.walk(folder) for name in names]
+    
+    def wait_for_removals(self):
+        from app.utils import file_organization
+        if file_organization._unlink_executor is not None:
+            file_organization._unlink_executor.submit(lambda: None).result()
+    
+    def test_reupload_replaces_file_and_storage(self):
+        self.upload_website_files(self.website.id, [('site/index.html', b'<p>one</p>'), ('site/app.js', b'12345')])
+        self.upload_website_files(self.website.id, [('site/app.js', b'1234567890')])
+        self.wait_for_removals()
+        db.session.expire_all()
+        
+        self.assertEqual(self.user.storage_used, 10 + 10)
+        self.assertEqual(WebsiteFile.query.filter_by(website_id=self.website.id).count(), 2)
+        self.assertEqual(File.query.count(), 2)
+        self.assertEqual(UserFile.query.filter_by(user_id=self.user.id).count(), 2)
+        self.assertEqual(len(self.stored_files()), 2)
+    
+    def test_duplicate_path_in_one_upload_is_stored_once(self):
+        self.upload_website_files(self.website.id, [('site/app.js', b'12345'), ('site/app.js', b'67890')])
+        db.session.expire_all()
+        
+        self.assertEqual(self.user.storage_used, 5)
+        self.assertEqual(WebsiteFile.query.filter_by(website_id=self.website.id).count(), 1)
+        self.assertEqual(File.query.count(), 1)
+        self.assertEqual(len(self.stored_files()), 1)
+
+
+class WebsiteQuotaTestCase(AppTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        self.register()
+        self.website = self.create_website()
+        self.user = User.query.filter_by(email='user@example.com').one()
+    
+    def set_storage_used(self, storage_used):
+        db.session.execute(db.update(User).where(User.id == self.user.id).values(storage_used=storage_used))
+        db.session.commit()
+    
+    def test_upload_that_exactly_fits_is_accepted(self):
+        self.set_storage_used(100 * 1024 * 1024 - 10)
+        self.upload_website_files(self.website.id, [('site/index.html', b'<p>x</p>'), ('site/a.js', b'12')])
+        db.session.expire_all()
+        
+        self.assertEqual(self.user.storage_used, 100 * 1024 * 1024)
+        self.assertEqual(WebsiteFile.query.filter_by(website_id=self.website.id).count(), 2)
+    
+    def test_file_past_quota_is_skipped(self):
+        self.set_storage_used(100 * 1024 * 1024 - 10)
+        self.upload_website_files(self.website.id, [('site/index.html', b'<p>x</p>'), ('site/a.js', b'123')])
+        db.session.expire_all()
+        
+        self.assertEqual(self.user.storage_used, 100 * 1024 * 1024 - 2)
+        self.assertEqual([wf.file_path for wf in WebsiteFile.query.filter_by(website_id=self.website.id)], ['index.html'])
+        self.assertEqual(File.query.count(), 1)